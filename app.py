@@ -1,9 +1,12 @@
 from fastapi import FastAPI
-from main import rec
+from fastapi.responses import Response
+import metrics
 from fastapi.openapi.utils import get_openapi
 import uvicorn
 
 app = FastAPI()
+# Main of the bot process, set by serve
+rec = None
 
 
 @app.post("/send_ndi")
@@ -12,6 +15,22 @@ async def root():
     return '200 OK!'
 
 
+@app.post("/stop_ndi")
+async def stop_ndi():
+    rec.rec.stop_ndi()
+    return '200 OK!'
+
+
+@app.get("/metrics")
+async def get_metrics():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/scheduler")
+async def get_scheduler():
+    return rec.scheduler.state()
+
+
 def custom_openapi():
     if app.openapi_schema:
         return app.openapi_schema
@@ -27,6 +46,18 @@ def custom_openapi():
 
 app.openapi = custom_openapi
 
-if __name__ == "__main__":
-    uvicorn.run("app:app", host="0.0.0.0", port=4446)
-    # uvicorn app:app --port 4446 --reload
+
+async def serve(main, host: str, port: int) -> None:
+    """
+    Function serves the API on the event loop of the bot process, so the routes see the same recognition, titles
+    and metrics as the running cameras
+
+    :param main: recognizer.Main of the bot
+    :param host: host to listen on
+    :param port: port to listen on
+    """
+    global rec
+    rec = main
+    server = uvicorn.Server(uvicorn.Config(app, host=host, port=port))
+    # while serving, uvicorn takes Ctrl+C: it shuts the API down and raises the signal again, which stops the bot
+    await server.serve()
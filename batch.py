@@ -0,0 +1,186 @@
+import argparse
+import json
+import multiprocessing as mp
+import os
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+
+from config import detection_scale, detection_upsample, caption_switch_frames, caption_min_hold, \
+    caption_clear_after, caption_policy, enrollment_processes
+from captions import CaptionController, select_on_air
+from detection import locate_faces, encode_good_faces
+from recognizer import Recognizer, FaceTracker, face_quality
+
+# Recognizer of a worker process, created once by the pool initializer
+_recognizer = None
+
+
+def _init_worker() -> None:
+    global _recognizer
+    # the parent has already synced the gallery with the people directory
+    _recognizer = Recognizer(sync=False)
+
+
+def video_chunks(path: str, chunk: float) -> Tuple[float, float, List[Tuple[str, int, int]]]:
+    """
+    Function splits a video into chunks of frames that can be processed independently
+
+    :param path: path to the video file
+    :param chunk: length of a chunk in seconds
+    :return: frame rate, duration in seconds and (path, first frame, end frame) of every chunk
+    """
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise ValueError(f'Cannot open video: {path}')
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+    frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+
+    size = max(1, int(round(chunk * fps)))
+    return fps, frames / fps, [(path, start, min(start + size, frames)) for start in range(0, frames, size)]
+
+
+def process_chunk(job: Tuple[str, int, int, float, float]) -> Tuple[str, List[Tuple[float, Optional[int]]]]:
+    """
+    Function recognizes faces on a chunk of a video in a worker process the same way a live camera is processed:
+    faces are tracked between sampled frames and only new people are encoded and matched
+
+    :param job: path to the video, first frame, end frame, frame rate of the video and sampled frames per second
+    :return: path to the video and (time in seconds, id of the person on the frame or None) of every sampled frame
+    """
+    path, start, end, fps, sample_fps = job
+    step = max(1, int(round(fps / sample_fps)))
+    tracker = FaceTracker()
+    observations = []
+
+    cap = cv2.VideoCapture(path)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    try:
+        for index in range(start, end):
+            # skipped frames are only grabbed, they are not converted to images
+            if not cap.grab():
+                break
+            if (index - start) % step:
+                continue
+            ok, frame = cap.retrieve()
+            if not ok:
+                continue
+
+            image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            people = tracker.update(image, locate_faces(image, detection_upsample, detection_scale))
+            pending = tracker.needs_identification(people)
+            if pending:
+                encodings, _ = encode_good_faces(image, [person.face_bounding_box.location() for person in pending],
+                                                 face_quality)
+                good = [(person, enc) for person, enc in zip(pending, encodings) if enc is not None]
+                _recognizer.identify_people(tracker, [person for person, _ in good], [enc for _, enc in good])
+            observations.append((index / fps, select_on_air([(person.face_id, person.face_bounding_box.location())
+                                                             for person in people if person.face_id is not None],
+                                                            image.shape, caption_policy)))
+    finally:
+        cap.release()
+        tracker.reset()
+    return path, observations
+
+
+def build_timeline(observations: List[Tuple[float, Optional[int]]], duration: float,
+                   names: Dict[int, Tuple[str, str]]) -> List[dict]:
+    """
+    Function runs observations of a whole video through the caption state machine of live shows, so a recorded
+    episode gets the same captions it would get on air
+
+    :param observations: (time in seconds, person id or None) sorted by time
+    :param duration: duration of the video in seconds
+    :param names: full name and role of every person id
+    :return: captions with person id, full name, role, start and end in seconds
+    """
+    captions = CaptionController(caption_switch_frames, caption_min_hold, caption_clear_after)
+    timeline = []
+    for now, face_id in observations:
+        if not captions.update(face_id, now):
+            continue
+        if timeline and timeline[-1]['end'] is None:
+            timeline[-1]['end'] = now
+        if captions.on_air is not None:
+            full_name, role = names.get(captions.on_air, ('', ''))
+            timeline.append({'person_id': captions.on_air, 'full_name': full_name, 'role': role,
+                             'start': now, 'end': None})
+    if timeline and timeline[-1]['end'] is None:
+        timeline[-1]['end'] = duration
+    return timeline
+
+
+def srt_time(seconds: float) -> str:
+    milliseconds = int(round(seconds * 1000))
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f'{hours:02}:{minutes:02}:{seconds:02},{milliseconds:03}'
+
+
+def write_srt(timeline: List[dict], path: Path) -> None:
+    with open(path, 'w', encoding='utf-8') as fout:
+        for number, caption in enumerate(timeline, start=1):
+            fout.write(f"{number}\n{srt_time(caption['start'])} --> {srt_time(caption['end'])}\n"
+                       f"{caption['full_name']}\n{caption['role']}\n\n")
+
+
+def caption_videos(paths: List[str], names: Dict[int, Tuple[str, str]], sample_fps: float = 5.0,
+                   chunk: float = 30.0, processes: Optional[int] = enrollment_processes) -> Dict[str, List[dict]]:
+    """
+    Function builds caption timelines of recorded videos. Videos are split into chunks that are processed by a pool
+    of worker processes, each with its own copy of the gallery
+
+    :param paths: paths to the videos
+    :param names: full name and role of every person id of the gallery
+    :param sample_fps: number of frames per second of video that are recognized
+    :param chunk: length of a chunk in seconds
+    :param processes: number of worker processes, None for all cores
+    :return: timeline of every video
+    """
+    jobs, durations = [], dict()
+    for path in paths:
+        fps, durations[path], chunks = video_chunks(path, chunk)
+        jobs += [(chunk_path, start, end, fps, sample_fps) for chunk_path, start, end in chunks]
+
+    observations = {path: [] for path in paths}
+    started = time.monotonic()
+    with mp.Pool(min(processes or os.cpu_count() or 1, max(1, len(jobs))), initializer=_init_worker) as pool:
+        for done, (path, chunk_observations) in enumerate(pool.imap_unordered(process_chunk, jobs), start=1):
+            observations[path] += chunk_observations
+            print(f'Processed {done}/{len(jobs)} chunks')
+    elapsed = time.monotonic() - started
+    print(f'{sum(durations.values()):.0f}s of video in {elapsed:.0f}s, '
+          f'{sum(durations.values()) / max(elapsed, 1e-9):.1f}x real time')
+
+    return {path: build_timeline(sorted(observations[path], key=lambda item: item[0]), durations[path], names)
+            for path in paths}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Builds caption timelines of recorded videos')
+    parser.add_argument('videos', nargs='+')
+    parser.add_argument('--fps', type=float, default=5.0, help='recognized frames per second of video')
+    parser.add_argument('--chunk', type=float, default=30.0, help='length of a chunk in seconds')
+    parser.add_argument('--processes', type=int, default=enrollment_processes, help='default: all cores')
+    parser.add_argument('--out', help='directory for timelines, next to the videos by default')
+    args = parser.parse_args()
+
+    # the gallery is synced once here, worker processes load it from the database
+    names = Recognizer().face_names
+    timelines = caption_videos(args.videos, names, args.fps, args.chunk, args.processes)
+    for path, timeline in timelines.items():
+        directory = Path(args.out) if args.out else Path(path).parent
+        directory.mkdir(parents=True, exist_ok=True)
+        json_path, srt_path = directory / f'{Path(path).stem}.json', directory / f'{Path(path).stem}.srt'
+        with open(json_path, 'w', encoding='utf-8') as fout:
+            json.dump(timeline, fout, ensure_ascii=False, indent=2)
+        write_srt(timeline, srt_path)
+        print(f'{path}: {len(timeline)} captions written to {json_path} and {srt_path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,364 @@
+import argparse
+import asyncio
+import json
+import platform
+import socket
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from face_index import make_index
+from functions import rss_bytes
+from matcher import FaceMatcher
+
+
+def synthetic_gallery(size: int, dim: int = 128, seed: int = 0):
+    """
+    Function generates encodings resembling a gallery of face encodings. Like real ones, they vary along a few
+    directions, so they fill a continuous space instead of separate clusters: random people are about 0.9 apart,
+    every person has look-alikes 0.35-0.55 apart and queries are about 0.35 from their own encoding
+
+    :param size: number of identities
+    :param dim: dimension of encodings
+    :param seed: random seed
+    :return: gallery encodings, queries that are noisy copies of random gallery encodings and ids of the copied
+             encodings
+    """
+    rng = np.random.default_rng(seed)
+    factors = 12
+    basis = rng.normal(0, 0.9 / np.sqrt(2 * factors * dim), (factors, dim))
+    gallery = rng.normal(0, 1, (size, factors)) @ basis + rng.normal(0, 0.2 / np.sqrt(2 * dim), (size, dim))
+    truth = rng.integers(size, size=200)
+    queries = gallery[truth] + rng.normal(0, 0.03, (len(truth), dim))
+    return gallery.astype(np.float32), queries.astype(np.float32), truth
+
+
+def bench_index(kind: str, gallery: np.ndarray, queries: np.ndarray, truth: np.ndarray, **params):
+    """
+    Function builds an index over the gallery and measures latency of single-query searches
+
+    :param truth: ids of exact nearest neighbours of the queries, recall is measured against them
+    :return: build time, median and p99 search latency and recall@1
+    """
+    index = make_index(kind, gallery.shape[1], **params)
+    start = time.perf_counter()
+    index.add(range(len(gallery)), gallery)
+    if kind == 'ivf' and not index.is_trained:
+        index.train()
+    build = time.perf_counter() - start
+
+    latencies = []
+    found = []
+    for query in queries:
+        start = time.perf_counter()
+        _, ids = index.search(query)
+        latencies.append(time.perf_counter() - start)
+        found.append(ids[0, 0])
+    latencies = np.array(latencies) * 1000
+    return {
+        'build_s': build,
+        'median_ms': float(np.median(latencies)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'recall': float(np.mean(np.array(found) == truth)),
+    }
+
+
+def bench_memory(directory: str = 'people'):
+    """
+    Function compares resident set size of keeping decoded gallery photos in memory, as Recognizer used to do,
+    with keeping only their encodings
+
+    :param directory: directory with gallery photos
+    :return: number of photos, RSS growth in bytes for decoded images and for encodings
+    """
+    import face_recognition
+
+    files = [file for file in sorted(Path(directory).iterdir()) if file.suffix.lower() in ('.jpg', '.jpeg', '.png')]
+    before = rss_bytes()
+    images = [face_recognition.load_image_file(file) for file in files]
+    with_images = rss_bytes() - before
+    del images
+
+    before = rss_bytes()
+    encodings = make_index('flat')
+    encodings.add(range(len(files)), np.zeros((len(files), 128), dtype=np.float32))
+    with_encodings = rss_bytes() - before
+    return len(files), with_images, with_encodings
+
+
+def measure(stage: str, fn, runs: int = 100, warmup: int = 3, items: int = 1, **params):
+    """
+    Function calls fn repeatedly and summarizes its latency. Peak memory is traced on a separate call, so tracing
+    doesn't slow down the timed ones
+
+    :param stage: name of the measured stage
+    :param fn: function without arguments
+    :param runs: number of timed calls
+    :param warmup: number of calls before timing
+    :param items: number of items (frames, faces, captions) processed by one call, used for throughput
+    :param params: parameters of the stage stored with the result
+    :return: result with median and p99 latency in milliseconds, items per second and peak traced bytes
+    """
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    latencies = np.array(latencies)
+    return {
+        'stage': stage,
+        'params': params,
+        'runs': runs,
+        'median_ms': float(np.median(latencies) * 1000),
+        'p99_ms': float(np.percentile(latencies, 99) * 1000),
+        'throughput': float(items * runs / latencies.sum()),
+        'peak_bytes': peak,
+    }
+
+
+def bench_conversion(frame: np.ndarray, runs: int):
+    buffer = np.empty_like(frame)
+    return measure('conversion', lambda: cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=buffer), runs,
+                   shape=list(frame.shape))
+
+
+def bench_detection(rgb: np.ndarray, runs: int, scale: float, upsample: int):
+    from detection import locate_faces
+
+    return measure('detection', lambda: locate_faces(rgb, upsample, scale), runs, scale=scale, upsample=upsample)
+
+
+def bench_encoding(rgb: np.ndarray, runs: int, faces: int):
+    from detection import locate_faces, encode_faces
+
+    locations = locate_faces(rgb)[:faces]
+    if not locations:
+        # synthetic frames have no faces, the encoder is timed on boxes in the middle of the frame
+        height, width = rgb.shape[:2]
+        side = min(height, width) // 4
+        locations = [(height // 2 - side // 2, left + side, height // 2 + side // 2, left)
+                     for left in np.linspace(0, width - side, faces + 2, dtype=int)[1:-1].tolist()]
+    return measure('encoding', lambda: encode_faces(rgb, locations), runs, items=len(locations),
+                   faces=len(locations))
+
+
+def bench_matching(size: int, batch: int, runs: int, photos_per_person: int = 3):
+    gallery, queries, _ = synthetic_gallery(size)
+    rng = np.random.default_rng(1)
+    matcher = FaceMatcher(0.6, make_index('flat'))
+    photos = np.repeat(gallery, photos_per_person, axis=0)
+    photos += rng.normal(0, 0.02, photos.shape).astype(np.float32)
+    matcher.add_many(range(len(photos)), np.repeat(np.arange(size), photos_per_person), photos)
+    queries = queries[:batch]
+    return measure('matching', lambda: matcher.match(queries), runs, items=batch, people=size, batch=batch)
+
+
+class FakeCaspar:
+    """
+    AMCP server stub answering every command with success, it lets the CasparCG client be measured without CasparCG
+    """
+
+    def __init__(self) -> None:
+        self.server = socket.create_server(('127.0.0.1', 0))
+        self.port = self.server.getsockname()[1]
+        threading.Thread(target=self.__serve, daemon=True).start()
+
+    def __serve(self) -> None:
+        while True:
+            connection, _ = self.server.accept()
+            with connection:
+                data = b''
+                while True:
+                    chunk = connection.recv(65536)
+                    if not chunk:
+                        break
+                    data += chunk
+                    while b'\r\n' in data:
+                        _, data = data.split(b'\r\n', 1)
+                        connection.sendall(b'202 CG OK\r\n')
+
+
+def bench_caspar(runs: int):
+    from caspar import CasparTitle, template_data
+
+    fake = FakeCaspar()
+    title = CasparTitle('127.0.0.1', fake.port)
+    names = [template_data(f'Person {i}', 'Guest') for i in range(2)]
+    counter = iter(range(10 ** 9))
+
+    def publish():
+        # commands are sent by the background thread of the title, the time until the server replies is measured
+        sent = title.sent
+        title.update(names[next(counter) % 2])
+        while title.sent == sent:
+            time.sleep(0)
+
+    return measure('publish_caspar', publish, runs)
+
+
+async def fake_obs(websocket) -> None:
+    """
+    obs-websocket v5 server stub without authentication answering every request batch with success
+    """
+    import websockets
+
+    await websocket.send(json.dumps({'op': 0, 'd': {'obsWebSocketVersion': '5.0.0', 'rpcVersion': 1}}))
+    try:
+        async for message in websocket:
+            message = json.loads(message)
+            if message['op'] == 1:
+                await websocket.send(json.dumps({'op': 2, 'd': {'negotiatedRpcVersion': 1}}))
+            elif message['op'] == 8:
+                results = [{'requestType': request['requestType'], 'requestStatus': {'result': True, 'code': 100}}
+                           for request in message['d']['requests']]
+                await websocket.send(json.dumps({'op': 9, 'd': {'requestId': message['d']['requestId'],
+                                                                'results': results}}))
+    except websockets.ConnectionClosed:
+        pass
+
+
+def bench_obs(runs: int):
+    import websockets
+    from obs_client import ObsClient
+
+    async def run():
+        async with websockets.serve(fake_obs, '127.0.0.1', 0) as server:
+            obs = ObsClient('127.0.0.1', server.sockets[0].getsockname()[1])
+            obs.start()
+            while not obs.connected:
+                await asyncio.sleep(0.01)
+
+            async def publish():
+                batches = obs.batches
+                obs.set_text('detected_name', f'Person {batches}')
+                while obs.batches == batches:
+                    await asyncio.sleep(0)
+
+            latencies = []
+            for i in range(runs + 3):
+                start = time.perf_counter()
+                await publish()
+                if i >= 3:
+                    latencies.append(time.perf_counter() - start)
+            obs.stop()
+            return latencies
+
+    latencies = np.array(asyncio.run(run()))
+    # the event loop can't be traced call by call, so peak memory isn't reported for this stage
+    return {
+        'stage': 'publish_obs',
+        'params': {},
+        'runs': runs,
+        'median_ms': float(np.median(latencies) * 1000),
+        'p99_ms': float(np.percentile(latencies, 99) * 1000),
+        'throughput': float(runs / latencies.sum()),
+        'peak_bytes': None,
+    }
+
+
+def bench_stages(frame_path: str = None, runs: int = 50, sizes=(100, 1000, 10000), scale: float = 0.5,
+                 upsample: int = 1, faces: int = 1):
+    """
+    Function measures every stage of the recognition hot path separately. Detection and encoding are skipped if
+    face_recognition isn't installed
+
+    :param frame_path: image used as a camera frame, a synthetic 1080p frame by default
+    :param runs: number of timed calls of every stage
+    :param sizes: numbers of people in synthetic galleries for matching
+    :return: list of results
+    """
+    if frame_path:
+        frame = cv2.imread(frame_path)
+    else:
+        frame = np.random.default_rng(0).integers(0, 256, (1080, 1920, 3), dtype=np.uint8)
+    rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+    results = [bench_conversion(frame, runs)]
+    try:
+        results.append(bench_detection(rgb, max(1, runs // 5), scale, upsample))
+        results.append(bench_encoding(rgb, max(1, runs // 5), faces))
+    except ImportError as e:
+        print(f'Detection and encoding skipped: {e}')
+    for size in sizes:
+        for batch in (1, 8):
+            results.append(bench_matching(size, batch, runs))
+    results.append(bench_caspar(runs))
+    results.append(bench_obs(runs))
+    return results
+
+
+def format_result(result) -> str:
+    peak = '' if result['peak_bytes'] is None else f" peak {result['peak_bytes'] / 2 ** 20:8.2f}MiB"
+    return (f"{result['stage']:<15} {json.dumps(result['params']):<40} median {result['median_ms']:8.3f}ms "
+            f"p99 {result['p99_ms']:8.3f}ms {result['throughput']:10.1f}/s{peak}")
+
+
+def environment():
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'rss_bytes': rss_bytes(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks of face index backends and of the recognition stages')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--probes', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--memory', metavar='DIR', help='report RSS of decoded photos vs encodings for a gallery')
+    parser.add_argument('--stages', action='store_true', help='measure every stage of the recognition hot path')
+    parser.add_argument('--frame', help='image used as a camera frame by --stages, synthetic 1080p by default')
+    parser.add_argument('--runs', type=int, default=50)
+    parser.add_argument('--faces', type=int, default=1, help='faces encoded per frame by --stages')
+    parser.add_argument('--json', metavar='FILE', help='write results to FILE to compare runs')
+    args = parser.parse_args()
+
+    if args.memory:
+        photos, with_images, with_encodings = bench_memory(args.memory)
+        print(f'{photos} photos: decoded images +{with_images / 2 ** 20:.1f} MiB RSS, '
+              f'encodings only +{with_encodings / 2 ** 20:.2f} MiB RSS')
+        return
+
+    if args.stages:
+        results = []
+        for result in bench_stages(args.frame, args.runs, args.sizes, faces=args.faces):
+            print(format_result(result))
+            results.append(result)
+    else:
+        results = []
+        for size in args.sizes:
+            gallery, queries, _ = synthetic_gallery(size)
+            exact = make_index('flat', gallery.shape[1])
+            exact.add(range(len(gallery)), gallery)
+            truth = exact.search(queries)[1][:, 0]
+            configs = [('flat', {})] + [('ivf', {'probes': probes}) for probes in args.probes]
+            for kind, params in configs:
+                result = bench_index(kind, gallery, queries, truth, **params)
+                print(f"{size:>7} {kind:>4} {str(params):<15} build {result['build_s']:7.2f}s "
+                      f"median {result['median_ms']:7.3f}ms p99 {result['p99_ms']:7.3f}ms "
+                      f"recall {result['recall']:.3f}")
+                results.append(dict(result, stage='index', params=dict(params, kind=kind, size=size)))
+
+    if args.json:
+        with open(args.json, 'w') as fout:
+            json.dump({'environment': environment(), 'results': results}, fout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+import time
+from typing import Optional, Sequence, Tuple
+
+Location = Tuple[int, int, int, int]
+
+
+def select_on_air(faces: Sequence[Tuple[int, Location]], frame_shape: Tuple[int, ...],
+                  policy: str = 'largest') -> Optional[int]:
+    """
+    Function chooses whose caption goes on air when several known people are in the frame
+
+    :param faces: id of a known person and location of their face in (top, right, bottom, left) order
+    :param frame_shape: shape of the frame
+    :param policy: 'largest' for the largest face, 'central' for the face closest to the centre of the frame,
+                   'first' for the first face
+    :return: id of the person or None if there are no known faces
+    """
+    if not faces:
+        return None
+    if policy == 'first':
+        return faces[0][0]
+    if policy == 'largest':
+        return max(faces, key=lambda face: (face[1][2] - face[1][0]) * (face[1][1] - face[1][3]))[0]
+    if policy == 'central':
+        height, width = frame_shape[:2]
+        return min(faces, key=lambda face: ((face[1][1] + face[1][3]) / 2 - width / 2) ** 2 +
+                                           ((face[1][0] + face[1][2]) / 2 - height / 2) ** 2)[0]
+    raise ValueError(f'Unknown caption policy: {policy}')
+
+
+class CaptionController:
+    switch_frames: int
+    min_hold: float
+    clear_after: float
+    on_air: Optional[int]
+
+    def __init__(self, switch_frames: int = 3, min_hold: float = 3.0, clear_after: float = 5.0) -> None:
+        """
+        Constructor creates a state machine that decides which person is on the title, so that the title is updated
+        only on real transitions and doesn't flicker
+
+        :param switch_frames: number of consecutive processed frames a new person has to be seen on before switching
+        :param min_hold: minimal time in seconds a person stays on the title
+        :param clear_after: time in seconds after which the title is cleared if the person on it isn't seen
+        """
+        self.switch_frames = switch_frames
+        self.min_hold = min_hold
+        self.clear_after = clear_after
+        self.on_air = None
+        self.on_air_since = 0.0
+        self.last_seen = 0.0
+        self.candidate = None
+        self.candidate_frames = 0
+        self.transitions = 0
+
+    def update(self, face_id: Optional[int], now: Optional[float] = None) -> bool:
+        """
+        Method feeds the identity seen on a processed frame into the state machine
+
+        :param face_id: id of the known face seen on the frame or None if nobody was recognized
+        :param now: current time, time.monotonic() by default
+        :return: True if the title has to be changed to on_air (None means the title has to be cleared)
+        """
+        now = time.monotonic() if now is None else now
+        held = now - self.on_air_since >= self.min_hold
+
+        if face_id is not None and face_id == self.on_air:
+            self.last_seen = now
+            self.candidate, self.candidate_frames = None, 0
+            return False
+
+        if face_id is None:
+            self.candidate, self.candidate_frames = None, 0
+        elif face_id == self.candidate:
+            self.candidate_frames += 1
+        else:
+            self.candidate, self.candidate_frames = face_id, 1
+
+        if self.candidate is not None and self.candidate_frames >= self.switch_frames and \
+                (self.on_air is None or held):
+            self.__switch(self.candidate, now)
+            return True
+
+        if self.on_air is not None and held and now - self.last_seen >= self.clear_after:
+            self.__switch(None, now)
+            return True
+
+        return False
+
+    def __switch(self, face_id: Optional[int], now: float) -> None:
+        self.on_air = face_id
+        self.on_air_since = now
+        self.last_seen = now
+        self.candidate, self.candidate_frames = None, 0
+        self.transitions += 1
+
+    def reset(self) -> None:
+        self.on_air = None
+        self.candidate, self.candidate_frames = None, 0
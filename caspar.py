@@ -0,0 +1,193 @@
+import threading
+import time
+from typing import Optional
+from xml.sax.saxutils import quoteattr
+
+from amcp_pylib.core import Client
+from amcp_pylib.module.template import CG_ADD, CG_UPDATE, CG_PLAY, CG_STOP
+
+import metrics
+
+
+def template_data(full_name: str, role: str) -> str:
+    """
+    Function builds templateData XML for the TITLE template
+
+    :param full_name: full name of the person
+    :param role: role of the person
+    :return: XML string
+    """
+    return (f'<templateData><componentData id="Text1"><data id="text" value={quoteattr(full_name)}/></componentData>'
+            f'<componentData id="Text2"><data id="text" value={quoteattr(role)}/></componentData></templateData>')
+
+
+class CasparTitle:
+    loaded: bool
+    playing: bool
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 5250, video_channel: int = 1, cg_layer: int = 1,
+                 template: str = 'TITLE', reconnect_delay: float = 5.0) -> None:
+        """
+        Constructor creates a title on a CasparCG CG layer. The template is loaded once and kept resident, new data
+        is sent with CG UPDATE and the title is taken on and off air with CG PLAY and CG STOP. AMCP commands are
+        sent by a background thread that brings CasparCG to the latest requested state, so callers never wait for
+        the server and intermediate updates are skipped
+
+        :param host: CasparCG host
+        :param port: AMCP port
+        :param video_channel: video channel of the title
+        :param cg_layer: CG layer of the title
+        :param template: template name
+        :param reconnect_delay: minimal time in seconds between connection attempts and retries of failed commands
+        """
+        self.host = host
+        self.port = port
+        self.video_channel = video_channel
+        self.cg_layer = cg_layer
+        self.template = template
+        self.reconnect_delay = reconnect_delay
+
+        self.client = None
+        self.last_attempt = None
+        self.loaded = False
+        self.playing = False
+        # data of the last successful CG ADD or CG UPDATE
+        self.data = None
+        self.errors = 0
+        self.sent = 0
+
+        self.condition = threading.Condition()
+        self.wanted_data = None
+        self.wanted_on_air = False
+        self.thread = None
+
+    def __connect(self) -> bool:
+        if self.client is not None:
+            return True
+        if self.last_attempt is not None and time.monotonic() - self.last_attempt < self.reconnect_delay:
+            return False
+        self.last_attempt = time.monotonic()
+        try:
+            client = Client()
+            client.connect(self.host, self.port, timeout=1.0)
+        except Exception as e:
+            self.errors += 1
+            metrics.publish_errors_total.inc('caspar')
+            print(f'CasparCG connection error: {e!r}')
+            return False
+        self.client = client
+        # a new connection may mean a restarted server without our template
+        self.loaded = False
+        self.playing = False
+        return True
+
+    def __send(self, command) -> bool:
+        if not self.__connect():
+            return False
+        start = time.perf_counter()
+        try:
+            response = self.client.send(command)
+        except Exception as e:
+            self.errors += 1
+            metrics.publish_errors_total.inc('caspar')
+            print(f'CasparCG command failed: {e!r}')
+            # the next command reconnects immediately and loads the template again
+            self.client = None
+            self.last_attempt = None
+            self.loaded = False
+            self.playing = False
+            return False
+        # error replies like 404 CG ADD FAILED are returned, not raised
+        if getattr(response, 'code', 0) >= 400:
+            self.errors += 1
+            metrics.publish_errors_total.inc('caspar')
+            print(f'CasparCG command failed: {response!r}')
+            # the layer may be empty, the template is loaded again with CG ADD
+            self.loaded = False
+            return False
+        metrics.publish_seconds.observe(time.perf_counter() - start, 'caspar')
+        self.sent += 1
+        return True
+
+    def __push(self, data: str) -> bool:
+        if self.loaded and self.__send(CG_UPDATE(video_channel=self.video_channel, cg_layer=self.cg_layer,
+                                                 data=data)):
+            self.data = data
+            return True
+        if not self.__connect():
+            return False
+        self.loaded = self.__send(CG_ADD(video_channel=self.video_channel, cg_layer=self.cg_layer,
+                                         template=self.template, play_on_load=0, data=data))
+        if self.loaded:
+            self.data = data
+        return self.loaded
+
+    def __play(self) -> bool:
+        play = CG_PLAY(video_channel=self.video_channel, cg_layer=self.cg_layer)
+        if self.data is None:
+            # no data was sent from this process, a template loaded by another client is played as is
+            return self.__send(play)
+        if (self.loaded or self.__push(self.data)) and self.__send(play):
+            return True
+        return self.__push(self.data) and self.__send(play)
+
+    def __in_sync(self) -> bool:
+        return (self.wanted_data is None or self.wanted_data == self.data) and self.wanted_on_air == self.playing
+
+    def __apply(self, data: Optional[str], on_air: bool) -> bool:
+        if data is not None and data != self.data and not self.__push(data):
+            return False
+        if on_air and not self.playing:
+            if not self.__play():
+                return False
+            self.playing = True
+        elif not on_air and self.playing:
+            if not self.__send(CG_STOP(video_channel=self.video_channel, cg_layer=self.cg_layer)):
+                return False
+            # CasparCG removes the template after its out animation
+            self.playing = False
+            self.loaded = False
+        return True
+
+    def __run(self) -> None:
+        while True:
+            with self.condition:
+                while self.__in_sync():
+                    self.condition.wait()
+                data, on_air = self.wanted_data, self.wanted_on_air
+            if not self.__apply(data, on_air):
+                # CasparCG is unavailable or refused a command, the latest state is applied again later
+                with self.condition:
+                    self.condition.wait(self.reconnect_delay)
+
+    def __request(self, data: Optional[str] = None, on_air: Optional[bool] = None) -> None:
+        with self.condition:
+            if data is not None:
+                self.wanted_data = data
+            if on_air is not None:
+                self.wanted_on_air = on_air
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.__run, name='caspar', daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+    def update(self, data: str) -> None:
+        """
+        Method requests new data of the title, the template is loaded with CG ADD only if it isn't loaded yet
+
+        :param data: templateData XML
+        """
+        self.__request(data=data)
+
+    def play(self) -> None:
+        """
+        Method requests the title on air with the latest data. If no data was sent from this process, only CG PLAY
+        is sent, so a template loaded with data by another client isn't replaced with an empty one
+        """
+        self.__request(on_air=True)
+
+    def stop(self) -> None:
+        """
+        Method requests the title off air, CasparCG removes the template after its out animation
+        """
+        self.__request(on_air=False)
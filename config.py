@@ -6,9 +6,66 @@ HELP = """<b>Добавить фото 📷</b> - кнопка для добав
 <b>Вывести человека с фото 👁️</b> - кнопка для вывода человека с фото;
 <b>Начать распознование🔍</b> - кнопка для включение распознавалки;
 <b>Закончить распознование🚫</b> - кнопка для выключения распознавалки, команду можно запустить, только после начала распознавания;
+<b>/memory</b> - сколько памяти занимает база лиц;
 """
 host = "172.24.64.1"
 port = 4455
 password = "Supervisor"
+# HTTP API (send_ndi, stop_ndi, metrics) is served by the bot process, api_port = None disables it
+api_host = "0.0.0.0"
+api_port = 4446
 users = []
 bot_password = "Supervisor"
+gallery_path = "gallery.db"
+match_tolerance = 0.6
+# number of people closest by their mean encoding whose every photo is compared with a face
+match_shortlist = 5
+# time in seconds between checks of the people directory for photos added, renamed or removed by hand, 0 - off
+gallery_watch_interval = 2.0
+# "flat" - exact search, "ivf" - approximate search for large galleries (e.g. params {"probes": 8})
+face_index = "flat"
+face_index_params = {}
+recognition_worker = True
+# number of processes encoding photos of the gallery, None - all cores
+enrollment_processes = None
+# faces are located on a frame downscaled by detection_scale and encoded on the full resolution one
+detection_scale = 0.5
+detection_upsample = 1
+# faces failing the quality gate aren't encoded: minimal face side in pixels, Laplacian variance of the face,
+# range of its mean brightness and maximal yaw (nose offset from the middle of the eyes over the eyes distance)
+face_min_size = 40
+face_min_sharpness = 25.0
+face_brightness_range = (40, 220)
+face_max_yaw = 0.4
+# frames are skipped while the scene doesn't change, but at least one per scene_max_interval seconds is processed
+scene_change_threshold = 4.0
+scene_max_interval = 2.0
+# maximal number of frames per second recognized on each camera
+camera_fps_budget = 10
+# adaptive scheduler keeps the time from capturing a frame to its caption decision under adaptive_latency seconds and
+# the busy time of recognition workers under adaptive_cpu_budget of their time by lowering the frame rate, detection
+# scale and upsampling above down to adaptive_min_fps and adaptive_min_scale, and restores them when there is headroom
+adaptive_scheduler = True
+adaptive_latency = 0.3
+adaptive_cpu_budget = 0.8
+adaptive_min_fps = 2
+adaptive_min_scale = 0.25
+# seconds between decisions of the scheduler
+adaptive_interval = 2.0
+# regions of each camera where faces can appear as (left, top, width, height) fractions of the frame, e.g.
+# {"cam1": [(0.0, 0.15, 1.0, 0.5)]}; regions shouldn't overlap, cameras not listed are processed whole
+camera_rois = {}
+# OBS text input for captions of each camera, "detected_name" for cameras not listed here
+caption_inputs = {}
+# a new person goes on the title after caption_switch_frames processed frames in a row and stays at least
+# caption_min_hold seconds, the title is cleared when the person isn't seen for caption_clear_after seconds
+caption_switch_frames = 3
+caption_min_hold = 3.0
+caption_clear_after = 5.0
+# whose caption goes on air when several known people are in the frame: "largest" face, "central" face or "first"
+caption_policy = "largest"
+caspar_host = "127.0.0.1"
+caspar_port = 5250
+caspar_channel = 1
+caspar_layer = 1
+caspar_template = "TITLE"
@@ -0,0 +1,60 @@
+from typing import List, Optional, Tuple
+
+import cv2
+import face_recognition
+import numpy as np
+
+from quality import FaceQuality, check_face
+
+Location = Tuple[int, int, int, int]
+
+
+def locate_faces(image: np.ndarray, upsample: int = 1, scale: float = 1.0) -> List[Location]:
+    """
+    Function finds faces on an RGB image with dlib HOG detector. With scale below 1 the detector runs on a downscaled
+    copy of the image and found boxes are mapped back to the original resolution
+
+    :param image: RGB image
+    :param upsample: how many times to upsample the image looking for smaller faces
+    :param scale: scale of the image the detector runs on
+    :return: list of face locations in (top, right, bottom, left) order
+    """
+    if scale >= 1:
+        return face_recognition.face_locations(image, number_of_times_to_upsample=upsample)
+
+    small = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    height, width = image.shape[:2]
+    locations = []
+    for top, right, bottom, left in face_recognition.face_locations(small, number_of_times_to_upsample=upsample):
+        locations.append((max(0, int(top / scale)), min(width, int(round(right / scale))),
+                          min(height, int(round(bottom / scale))), max(0, int(left / scale))))
+    return locations
+
+
+def encode_faces(image: np.ndarray, locations: List[Location]) -> List[np.ndarray]:
+    """
+    Function computes 128-d encodings of already located faces
+
+    :param image: RGB image
+    :param locations: face locations in (top, right, bottom, left) order
+    :return: list of encodings in the same order as locations
+    """
+    if not locations:
+        return []
+    return face_recognition.face_encodings(image, known_face_locations=locations)
+
+
+def encode_good_faces(image: np.ndarray, locations: List[Location],
+                      quality: FaceQuality) -> Tuple[List[Optional[np.ndarray]], List[Optional[str]]]:
+    """
+    Function encodes only faces that pass the quality gate, small, badly exposed, blurry and profile faces are
+    rejected before the expensive encoder runs
+
+    :param image: RGB image
+    :param locations: face locations in (top, right, bottom, left) order
+    :param quality: quality thresholds
+    :return: encodings in the same order as locations with None for rejected faces, and rejection reasons
+    """
+    reasons = [check_face(image, location, quality) for location in locations]
+    encodings = iter(encode_faces(image, [location for location, reason in zip(locations, reasons) if reason is None]))
+    return [next(encodings) if reason is None else None for reason in reasons], reasons
@@ -0,0 +1,160 @@
+import argparse
+import multiprocessing as mp
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import face_recognition
+import numpy as np
+
+from config import gallery_path, enrollment_processes
+from detection import locate_faces, encode_faces
+from functions import free_photo_path
+from gallery import GalleryStore
+
+IMG_EXTENSIONS = ['jpg', 'jpeg', 'png', 'bmp']
+
+
+def parse_filename(filename: str) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Function parses name and role of a person from a photo file name like Full_Name-Role.jpg or Full_Name-Role-2.jpg
+
+    :param filename: name of the file
+    :return: full name and role or (None, None) if the file is named incorrectly
+    """
+    file_name_parts = filename.split('.')
+    file_ext = file_name_parts[-1]
+
+    if len(file_name_parts) != 2:
+        print(f'File named incorrectly: {filename}')
+        return None, None
+
+    if file_ext not in IMG_EXTENSIONS:
+        print(f'Unsupported file type: {file_ext}')
+        return None, None
+
+    person_name_parts = file_name_parts[0].split('-')
+    if len(person_name_parts) < 2 or len(person_name_parts) > 3:
+        print(f'File named incorrectly: {filename}')
+        return None, None
+
+    if len(person_name_parts) == 3:
+        person_name_parts = person_name_parts[:2]
+
+    full_name, role = person_name_parts
+    full_name = " ".join(full_name.split('_'))
+    role = " ".join(role.split('_'))
+    return full_name, role
+
+
+def encode_photo(path: str) -> Tuple[Optional[np.ndarray], int]:
+    """
+    Function decodes a photo once and encodes the face on it. Like photos uploaded to the bot, a photo is rejected if
+    there is no face or more than one face on it
+
+    :param path: path to the photo
+    :return: face encoding or None if the photo is rejected, and the number of faces found
+    """
+    try:
+        image = face_recognition.load_image_file(path)
+    except Exception as e:
+        print(f'Cannot read photo {Path(path).name}: {e}')
+        return None, 0
+    locations = locate_faces(image)
+    if len(locations) != 1:
+        return None, len(locations)
+    return encode_faces(image, locations)[0], 1
+
+
+def print_progress(done: int, total: int, started: float) -> None:
+    if done == total or done % max(1, total // 20) == 0:
+        elapsed = time.monotonic() - started
+        print(f'Encoded {done}/{total} photos, {done / max(elapsed, 1e-9):.1f} photos/s')
+
+
+def encode_photos(paths: Sequence[Path], processes: Optional[int] = enrollment_processes,
+                  progress: Optional[Callable] = print_progress) -> List[Optional[np.ndarray]]:
+    """
+    Function encodes faces on many photos with a pool of processes, one per core by default
+
+    :param paths: paths to the photos
+    :param processes: number of processes, None for all cores
+    :param progress: function called with numbers of encoded and all photos and the start time, None for silence
+    :return: face encodings in the same order as paths, None for rejected photos
+    """
+    paths = [str(path) for path in paths]
+    if not paths:
+        return []
+    processes = min(processes or os.cpu_count() or 1, len(paths))
+    started = time.monotonic()
+
+    encodings = [None] * len(paths)
+    pool = mp.Pool(processes) if processes > 1 else None
+    try:
+        results = pool.imap(encode_photo, paths, chunksize=max(1, min(16, len(paths) // (4 * processes)))) \
+            if pool is not None else map(encode_photo, paths)
+        for done, (path, (encoding, faces)) in enumerate(zip(paths, results), start=1):
+            if encoding is None:
+                print(f'Photo rejected, {faces} faces found: {Path(path).name}')
+            encodings[done - 1] = encoding
+            if progress is not None:
+                progress(done, len(paths), started)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return encodings
+
+
+def import_directory(source: Path, store: GalleryStore, people_dir: Path = Path('people'), move: bool = False,
+                     processes: Optional[int] = enrollment_processes) -> Tuple[int, int]:
+    """
+    Function enrolls photos from a folder: faces are encoded in parallel, accepted photos are copied to the people
+    directory under free names and added to the gallery in one transaction
+
+    :param source: folder with photos named like Full_Name-Role.jpg
+    :param store: gallery the photos are added to
+    :param people_dir: directory of the gallery photos
+    :param move: move the photos instead of copying them
+    :param processes: number of processes, None for all cores
+    :return: numbers of added and rejected photos
+    """
+    people_dir.mkdir(parents=True, exist_ok=True)
+    files, names = [], []
+    for file in sorted(source.iterdir()):
+        if not file.is_file():
+            continue
+        full_name, role = parse_filename(file.name)
+        if full_name is not None and role is not None:
+            files.append(file)
+            names.append((full_name, role))
+
+    photos = []
+    for file, (full_name, role), encoding in zip(files, names, encode_photos(files, processes)):
+        if encoding is None:
+            continue
+        name = '_'.join(full_name.split()) + '-' + '_'.join(role.split())
+        path = Path(free_photo_path(name, str(people_dir), file.suffix[1:]))
+        (shutil.move if move else shutil.copy2)(file, path)
+        photos.append((full_name, role, path, encoding))
+    store.add_photos(photos)
+    return len(photos), len(files) - len(photos)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Adds photos from a folder to the gallery of known people')
+    parser.add_argument('folder', help='folder with photos named like Full_Name-Role.jpg')
+    parser.add_argument('--processes', type=int, default=enrollment_processes, help='default: all cores')
+    parser.add_argument('--move', action='store_true', help='move photos to the people directory instead of copying')
+    parser.add_argument('--gallery', default=gallery_path)
+    args = parser.parse_args()
+
+    added, rejected = import_directory(Path(args.folder), GalleryStore(args.gallery), move=args.move,
+                                       processes=args.processes)
+    print(f'Added {added} photos, rejected {rejected}')
+
+
+if __name__ == '__main__':
+    main()
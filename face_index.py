@@ -0,0 +1,266 @@
+from typing import Dict, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+Encodings = Union[np.ndarray, Sequence[np.ndarray]]
+
+
+class FlatIndex:
+    dim: int
+    size: int
+
+    def __init__(self, dim: int = 128) -> None:
+        """
+        Constructor creates an exact index that compares queries with every stored encoding
+
+        :param dim: dimension of face encodings
+        """
+        self.dim = dim
+        self.size = 0
+        self._data = np.empty((16, dim), dtype=np.float32)
+        self._sq_norms = np.empty(16, dtype=np.float32)
+        self._ids = np.empty(16, dtype=np.int64)
+        self._rows = dict()
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __contains__(self, face_id: int) -> bool:
+        return face_id in self._rows
+
+    @property
+    def matrix(self) -> np.ndarray:
+        return self._data[:self.size]
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._ids[:self.size]
+
+    @property
+    def nbytes(self) -> int:
+        return self._data.nbytes + self._sq_norms.nbytes + self._ids.nbytes
+
+    def __reserve(self, size: int) -> None:
+        if size <= len(self._data):
+            return
+        capacity = max(size, 2 * len(self._data))
+        data = np.empty((capacity, self.dim), dtype=np.float32)
+        data[:self.size] = self._data[:self.size]
+        sq_norms = np.empty(capacity, dtype=np.float32)
+        sq_norms[:self.size] = self._sq_norms[:self.size]
+        ids = np.empty(capacity, dtype=np.int64)
+        ids[:self.size] = self._ids[:self.size]
+        self._data, self._sq_norms, self._ids = data, sq_norms, ids
+
+    def add(self, ids: Sequence[int], encodings: Encodings) -> None:
+        """
+        Method appends encodings to the index, growing the storage geometrically
+
+        :param ids: ids of the encodings
+        :param encodings: 128-d face encodings
+        """
+        encodings = np.atleast_2d(np.asarray(encodings, dtype=np.float32))
+        self.__reserve(self.size + len(encodings))
+
+        rows = slice(self.size, self.size + len(encodings))
+        self._data[rows] = encodings
+        self._sq_norms[rows] = np.einsum('ij,ij->i', encodings, encodings)
+        self._ids[rows] = ids
+        for row, face_id in enumerate(ids, start=self.size):
+            self._rows[int(face_id)] = row
+        self.size += len(encodings)
+
+    def remove(self, face_id: int) -> None:
+        """
+        Method removes encoding from the index by moving the last row in its place
+
+        :param face_id: id of the encoding to remove
+        """
+        row = self._rows.pop(face_id)
+        last = self.size - 1
+        if row != last:
+            self._data[row] = self._data[last]
+            self._sq_norms[row] = self._sq_norms[last]
+            self._ids[row] = self._ids[last]
+            self._rows[int(self._ids[row])] = row
+        self.size -= 1
+
+    def distances(self, queries: Encodings) -> np.ndarray:
+        """
+        Method computes euclidean distances between query encodings and every stored encoding with one matrix product
+
+        :param queries: one encoding or a batch of encodings
+        :return: matrix of distances with shape (number of queries, index size)
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        sq_distances = np.einsum('ij,ij->i', queries, queries)[:, None] + self._sq_norms[:self.size][None, :]
+        sq_distances -= 2 * (queries @ self.matrix.T)
+        np.maximum(sq_distances, 0, out=sq_distances)
+        return np.sqrt(sq_distances, out=sq_distances)
+
+    def search(self, queries: Encodings, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Method finds k closest encodings for each query
+
+        :param queries: one encoding or a batch of encodings
+        :param k: number of neighbours
+        :return: distances and ids of neighbours sorted by distance, both with shape (number of queries, k);
+                 missing neighbours have infinite distance and id -1
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        if self.size == 0:
+            return distances, ids
+
+        all_distances = self.distances(queries)
+        found = min(k, self.size)
+        top = np.argpartition(all_distances, found - 1, axis=1)[:, :found]
+        top_distances = np.take_along_axis(all_distances, top, axis=1)
+        order = np.argsort(top_distances, axis=1)
+        distances[:, :found] = np.take_along_axis(top_distances, order, axis=1)
+        ids[:, :found] = self.ids[np.take_along_axis(top, order, axis=1)]
+        return distances, ids
+
+
+class IVFIndex:
+    dim: int
+    partitions: Optional[int]
+    probes: int
+
+    def __init__(self, dim: int = 128, partitions: Optional[int] = None, probes: int = 8,
+                 train_size: int = 1000) -> None:
+        """
+        Constructor creates an approximate inverted file index: encodings are split into partitions around k-means
+        centroids and a query is compared only with encodings of its closest partitions
+
+        :param dim: dimension of face encodings
+        :param partitions: number of partitions, by default square root of the index size at training time
+        :param probes: number of partitions scanned for each query, more probes give better recall and higher latency
+        :param train_size: index size after which partitions are trained, smaller indexes are scanned exactly
+        """
+        self.dim = dim
+        self.partitions = partitions
+        self.probes = probes
+        self.train_size = train_size
+        self.centroids = None
+        self._lists = [FlatIndex(dim)]
+        self._list_of = dict()
+
+    def __len__(self) -> int:
+        return len(self._list_of)
+
+    def __contains__(self, face_id: int) -> bool:
+        return face_id in self._list_of
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    @property
+    def nbytes(self) -> int:
+        centroids = self.centroids.nbytes if self.centroids is not None else 0
+        return centroids + sum(lst.nbytes for lst in self._lists)
+
+    def train(self, iterations: int = 10, seed: int = 0) -> None:
+        """
+        Method clusters all stored encodings with k-means and redistributes them between partitions
+
+        :param iterations: number of Lloyd iterations
+        :param seed: seed for choosing initial centroids
+        """
+        ids = np.concatenate([lst.ids for lst in self._lists])
+        data = np.concatenate([lst.matrix for lst in self._lists])
+        partitions = self.partitions or max(1, int(np.sqrt(len(data))))
+        partitions = min(partitions, len(data))
+        if partitions == 0:
+            return
+
+        rng = np.random.default_rng(seed)
+        centroids = FlatIndex(self.dim)
+        centroids.add(range(partitions), data[rng.choice(len(data), partitions, replace=False)])
+        for _ in range(iterations):
+            _, assignment = centroids.search(data)
+            order = np.argsort(assignment[:, 0], kind='stable')
+            filled, starts, counts = np.unique(assignment[order, 0], return_index=True, return_counts=True)
+            centers = centroids.matrix.copy()
+            centers[filled] = np.add.reduceat(data[order], starts) / counts[:, None]
+            centroids = FlatIndex(self.dim)
+            centroids.add(range(partitions), centers)
+
+        self.centroids = centroids
+        self._lists = [FlatIndex(self.dim) for _ in range(partitions)]
+        self._list_of = dict()
+        self.__assign(ids, data)
+
+    def __assign(self, ids: np.ndarray, data: np.ndarray) -> None:
+        if self.centroids is None:
+            assignment = np.zeros(len(data), dtype=np.int64)
+        else:
+            _, assignment = self.centroids.search(data)
+            assignment = assignment[:, 0]
+        for partition in np.unique(assignment):
+            rows = assignment == partition
+            self._lists[partition].add(ids[rows], data[rows])
+        self._list_of.update(zip(ids.tolist(), assignment.tolist()))
+
+    def add(self, ids: Sequence[int], encodings: Encodings) -> None:
+        """
+        Method adds encodings to the partitions of their closest centroids; partitions are trained once the index
+        grows to train_size
+
+        :param ids: ids of the encodings
+        :param encodings: 128-d face encodings
+        """
+        encodings = np.atleast_2d(np.asarray(encodings, dtype=np.float32))
+        self.__assign(np.asarray(ids, dtype=np.int64), encodings)
+        if not self.is_trained and len(self) >= self.train_size:
+            self.train()
+
+    def remove(self, face_id: int) -> None:
+        """
+        Method removes encoding from its partition
+
+        :param face_id: id of the encoding to remove
+        """
+        self._lists[self._list_of.pop(face_id)].remove(face_id)
+
+    def search(self, queries: Encodings, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Method finds approximately k closest encodings for each query scanning only `probes` closest partitions
+
+        :param queries: one encoding or a batch of encodings
+        :param k: number of neighbours
+        :return: distances and ids of neighbours sorted by distance, both with shape (number of queries, k);
+                 missing neighbours have infinite distance and id -1
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        if not self.is_trained:
+            return self._lists[0].search(queries, k)
+
+        _, probed = self.centroids.search(queries, min(self.probes, len(self._lists)))
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        ids = np.full((len(queries), k), -1, dtype=np.int64)
+        for i, query in enumerate(queries):
+            results = [self._lists[partition].search(query, k) for partition in probed[i] if partition >= 0]
+            candidate_distances = np.concatenate([result[0][0] for result in results])
+            candidate_ids = np.concatenate([result[1][0] for result in results])
+            order = np.argsort(candidate_distances)[:k]
+            distances[i, :len(order)] = candidate_distances[order]
+            ids[i, :len(order)] = candidate_ids[order]
+        return distances, ids
+
+
+def make_index(kind: str = 'flat', dim: int = 128, **params) -> Union[FlatIndex, IVFIndex]:
+    """
+    Function creates face index by its name
+
+    :param kind: 'flat' for exact search or 'ivf' for approximate search over partitions
+    :param dim: dimension of face encodings
+    :param params: parameters of the index
+    :return: empty index
+    """
+    indexes: Dict[str, type] = {'flat': FlatIndex, 'ivf': IVFIndex}
+    if kind not in indexes:
+        raise ValueError(f'Unknown face index: {kind}')
+    return indexes[kind](dim, **params)
@@ -1,27 +1,65 @@
+import os
 import shutil
-import glob
+from typing import Optional
 
+import cv2
+import numpy as np
 
-def load_photo_with_name(name: str):
-    count = len(glob.glob(f'people/{name}*.jpg'))
-    if count > 0 :
-        path = f"people/{name}-{count + 1}.jpg"
-        shutil.move("uploaded/1.jpg", path)
-    else:
-        path = f"people/{name}.jpg"
-        shutil.move("uploaded/1.jpg", path)
+
+def free_photo_path(name: str, directory: str = "people", ext: str = "jpg"):
+    path = f"{directory}/{name}.{ext}"
+    count = 1
+    while os.path.exists(path):
+        count += 1
+        path = f"{directory}/{name}-{count}.{ext}"
+    return path
+
+
+def load_photo_with_name(name: str, uploaded: str = "uploaded/1.jpg"):
+    path = free_photo_path(name)
+    shutil.move(uploaded, path)
     return path
 
 
-def parse_filename(filename):
-    name = filename[7:-4]
-    full_name, role = name[:name.index('-')], name[name.index('-') + 1:]
-    full_name = " ".join(full_name.split('_'))
-    return full_name, role
+def load_preview(path: str, max_side: int = 1280) -> Optional[bytes]:
+    """
+    Function decodes a photo on demand and returns it downscaled to max_side as JPEG, the decoded image isn't kept
+
+    :param path: path to the photo
+    :param max_side: maximal width or height of the preview
+    :return: JPEG bytes or None if the photo can't be read
+    """
+    # cv2.imread can't open non-ASCII paths on Windows, so the file is read by numpy and decoded from memory
+    try:
+        data = np.fromfile(path, np.uint8)
+    except OSError:
+        return None
+    image = cv2.imdecode(data, cv2.IMREAD_REDUCED_COLOR_2 if data.size > 2 ** 21 else cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+    scale = max_side / max(image.shape[:2])
+    if scale < 1:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 85])[1].tobytes()
+
+
+def rss_bytes():
+    """
+    Function returns resident set size of the current process or None if it can't be measured
+    """
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open('/proc/self/statm') as fin:
+            return int(fin.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
 
 
 async def show_people(message, people, main_menu):
     for idx, person in enumerate(people):
-        full_name, role = parse_filename(person)
-        await message.answer(f"{idx + 1}) {full_name} -- {role}")
+        await message.answer(f"{idx + 1}) {person.full_name} -- {person.role}")
     await message.answer("Текущая база людей", reply_markup=main_menu)
\ No newline at end of file
@@ -0,0 +1,279 @@
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Callable, Iterator, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class PersonRecord(NamedTuple):
+    id: int
+    full_name: str
+    role: str
+    photos: int
+
+
+class PhotoRecord(NamedTuple):
+    id: int
+    person_id: int
+    full_name: str
+    role: str
+    path: str
+
+
+class SyncResult(NamedTuple):
+    kept: int
+    added: List[int]
+    changed: List[int]
+    renamed: List[int]
+    removed: List[int]
+
+
+class GalleryStore:
+
+    def __init__(self, path: str = 'gallery.db') -> None:
+        """
+        Constructor opens SQLite gallery of known people and their photos with face encodings.
+        Every change is a single transaction, ids of people and photos never change
+
+        :param path: path to the database file
+        """
+        self.path = path
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute('PRAGMA foreign_keys = ON')
+        self.db.execute('PRAGMA journal_mode = WAL')
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS persons ('
+                            'id INTEGER PRIMARY KEY, full_name TEXT NOT NULL, role TEXT NOT NULL, '
+                            'UNIQUE (full_name, role))')
+            self.db.execute('CREATE TABLE IF NOT EXISTS photos ('
+                            'id INTEGER PRIMARY KEY, '
+                            'person_id INTEGER NOT NULL REFERENCES persons (id) ON DELETE CASCADE, '
+                            'path TEXT NOT NULL UNIQUE, mtime_ns INTEGER, size INTEGER, encoding BLOB)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS photos_person ON photos (person_id)')
+
+    @staticmethod
+    def __stat(path: Path) -> Tuple[int, int]:
+        stat = path.stat()
+        return stat.st_mtime_ns, stat.st_size
+
+    @staticmethod
+    def __pack(encoding: Optional[np.ndarray]) -> Optional[bytes]:
+        return None if encoding is None else np.asarray(encoding, dtype=np.float32).tobytes()
+
+    def __person_id(self, full_name: str, role: str) -> int:
+        row = self.db.execute('SELECT id FROM persons WHERE full_name = ? AND role = ?', (full_name, role)).fetchone()
+        if row is not None:
+            return row[0]
+        return self.db.execute('INSERT INTO persons (full_name, role) VALUES (?, ?)', (full_name, role)).lastrowid
+
+    def get_or_add_person(self, full_name: str, role: str) -> int:
+        """
+        Method returns id of a person, the person is created if there is no person with such name and role
+
+        :param full_name: full name of the person
+        :param role: role of the person
+        :return: person id
+        """
+        with self.lock, self.db:
+            return self.__person_id(full_name, role)
+
+    def add_photo(self, person_id: int, path: Path, encoding: Optional[np.ndarray]) -> int:
+        """
+        Method stores a photo of a person with its face encoding
+
+        :param person_id: id of the person
+        :param path: path to the photo
+        :param encoding: 128-d face encoding or None if there is no face on the photo
+        :return: photo id
+        """
+        mtime_ns, size = GalleryStore.__stat(Path(path))
+        with self.lock, self.db:
+            return self.db.execute('INSERT INTO photos (person_id, path, mtime_ns, size, encoding) '
+                                   'VALUES (?, ?, ?, ?, ?)',
+                                   (person_id, str(path), mtime_ns, size, GalleryStore.__pack(encoding))).lastrowid
+
+    def add_photos(self, photos: Sequence[Tuple[str, str, Path, Optional[np.ndarray]]]) -> List[int]:
+        """
+        Method stores photos of several people in one transaction, people are created when needed
+
+        :param photos: (full name, role, path, encoding) of every photo
+        :return: photo ids in the same order
+        """
+        stats = [GalleryStore.__stat(Path(path)) for _, _, path, _ in photos]
+        photo_ids = []
+        with self.lock, self.db:
+            for (full_name, role, path, encoding), (mtime_ns, size) in zip(photos, stats):
+                photo_ids.append(self.db.execute('INSERT INTO photos (person_id, path, mtime_ns, size, encoding) '
+                                                 'VALUES (?, ?, ?, ?, ?)',
+                                                 (self.__person_id(full_name, role), str(path), mtime_ns, size,
+                                                  GalleryStore.__pack(encoding))).lastrowid)
+        return photo_ids
+
+    def remove_photo(self, photo_id: int) -> Optional[PhotoRecord]:
+        """
+        Method removes a photo, a person without photos is removed too
+
+        :param photo_id: id of the photo
+        :return: removed photo or None if there is no such photo
+        """
+        with self.lock, self.db:
+            photo = self.photo(photo_id)
+            if photo is None:
+                return None
+            self.db.execute('DELETE FROM photos WHERE id = ?', (photo_id,))
+            self.db.execute('DELETE FROM persons WHERE id = ? AND NOT EXISTS '
+                            '(SELECT 1 FROM photos WHERE person_id = persons.id)', (photo.person_id,))
+            return photo
+
+    def rename_person(self, person_id: int, full_name: str, role: str) -> int:
+        """
+        Method changes name and role of a person. If another person already has this name and role, photos are moved
+        to that person
+
+        :param person_id: id of the person
+        :param full_name: new full name
+        :param role: new role
+        :return: id of the person that owns the photos now
+        """
+        with self.lock, self.db:
+            row = self.db.execute('SELECT id FROM persons WHERE full_name = ? AND role = ? AND id != ?',
+                                  (full_name, role, person_id)).fetchone()
+            if row is None:
+                self.db.execute('UPDATE persons SET full_name = ?, role = ? WHERE id = ?',
+                                (full_name, role, person_id))
+                return person_id
+            self.db.execute('UPDATE photos SET person_id = ? WHERE person_id = ?', (row[0], person_id))
+            self.db.execute('DELETE FROM persons WHERE id = ?', (person_id,))
+            return row[0]
+
+    def person(self, person_id: int) -> Optional[PersonRecord]:
+        with self.lock:
+            row = self.db.execute('SELECT persons.id, full_name, role, COUNT(photos.id) FROM persons '
+                                  'LEFT JOIN photos ON photos.person_id = persons.id AND photos.encoding IS NOT NULL '
+                                  'WHERE persons.id = ? GROUP BY persons.id', (person_id,)).fetchone()
+        return None if row is None else PersonRecord(*row)
+
+    def persons(self) -> List[PersonRecord]:
+        """
+        Method returns people that have at least one photo with a face, ordered by id
+        """
+        with self.lock:
+            rows = self.db.execute('SELECT persons.id, full_name, role, COUNT(photos.id) FROM persons '
+                                   'JOIN photos ON photos.person_id = persons.id AND photos.encoding IS NOT NULL '
+                                   'GROUP BY persons.id ORDER BY persons.id').fetchall()
+        return [PersonRecord(*row) for row in rows]
+
+    def photo(self, photo_id: int) -> Optional[PhotoRecord]:
+        with self.lock:
+            row = self.db.execute('SELECT photos.id, person_id, full_name, role, path FROM photos '
+                                  'JOIN persons ON persons.id = photos.person_id WHERE photos.id = ?',
+                                  (photo_id,)).fetchone()
+        return None if row is None else PhotoRecord(*row)
+
+    def photos(self, person_id: Optional[int] = None) -> List[PhotoRecord]:
+        """
+        Method returns photos with a face, ordered by id
+
+        :param person_id: return only photos of this person
+        """
+        query = ('SELECT photos.id, person_id, full_name, role, path FROM photos '
+                 'JOIN persons ON persons.id = photos.person_id WHERE photos.encoding IS NOT NULL')
+        params = ()
+        if person_id is not None:
+            query += ' AND person_id = ?'
+            params = (person_id,)
+        with self.lock:
+            rows = self.db.execute(query + ' ORDER BY photos.id', params).fetchall()
+        return [PhotoRecord(*row) for row in rows]
+
+    def encodings(self, photo_ids: Optional[Sequence[int]] = None) -> Iterator[Tuple[int, int, np.ndarray]]:
+        """
+        Method returns stored face encodings
+
+        :param photo_ids: return only encodings of these photos
+        :return: iterator of (photo id, person id, encoding)
+        """
+        query = 'SELECT id, person_id, encoding FROM photos WHERE encoding IS NOT NULL'
+        params = ()
+        if photo_ids is not None:
+            photo_ids = list(photo_ids)
+            if not photo_ids:
+                return
+            query += f' AND id IN ({",".join("?" * len(photo_ids))})'
+            params = tuple(photo_ids)
+        with self.lock:
+            rows = self.db.execute(query + ' ORDER BY id', params).fetchall()
+        for photo_id, person_id, encoding in rows:
+            yield photo_id, person_id, np.frombuffer(encoding, dtype=np.float32)
+
+    def sync_directory(self, directory: Path, parse: Callable, encode: Callable) -> SyncResult:
+        """
+        Method brings the gallery in line with photos in a directory: photos that didn't change are kept, changed
+        photos are encoded again, new photos are added and photos missing on disk are removed. A new file with the
+        modification time and size of a missing one is a renamed photo, it keeps its encoding and moves to the person
+        of its new name. All photos that need encoding are passed to encode at once and the results are stored in one
+        transaction
+
+        :param directory: directory with photos
+        :param parse: function returning (full name, role) from a file name or (None, None) to skip the file
+        :param encode: function returning face encodings (or None) of a list of photo files in the same order
+        :return: number of kept photos and ids of added, changed, renamed and removed photos
+        """
+        with self.lock:
+            known = {path: (photo_id, mtime_ns, size) for photo_id, path, mtime_ns, size in
+                     self.db.execute('SELECT id, path, mtime_ns, size FROM photos').fetchall()}
+        kept = 0
+        seen = set()
+        changed, new = [], []
+        for file in sorted(directory.iterdir()):
+            if not file.is_file():
+                continue
+            path = str(file)
+            if path in known:
+                seen.add(path)
+                photo_id, mtime_ns, size = known[path]
+                if (mtime_ns, size) == GalleryStore.__stat(file):
+                    kept += 1
+                else:
+                    changed.append((photo_id, file))
+                continue
+
+            full_name, role = parse(file.name)
+            if full_name is not None and role is not None:
+                new.append((full_name, role, file))
+
+        missing = dict()
+        for path, (photo_id, mtime_ns, size) in known.items():
+            if path not in seen:
+                missing.setdefault((mtime_ns, size), []).append(photo_id)
+        renamed, added = [], []
+        for full_name, role, file in new:
+            candidates = missing.get(GalleryStore.__stat(file))
+            photo_id = candidates.pop() if candidates else None
+            if photo_id is None:
+                added.append((full_name, role, file))
+            else:
+                renamed.append((photo_id, full_name, role, file))
+
+        encodings = encode([file for _, file in changed] + [file for _, _, file in added]) if changed or added else []
+        with self.lock, self.db:
+            for (photo_id, file), encoding in zip(changed, encodings):
+                mtime_ns, size = GalleryStore.__stat(file)
+                self.db.execute('UPDATE photos SET mtime_ns = ?, size = ?, encoding = ? WHERE id = ?',
+                                (mtime_ns, size, GalleryStore.__pack(encoding), photo_id))
+            for photo_id, full_name, role, file in renamed:
+                old_person_id = self.db.execute('SELECT person_id FROM photos WHERE id = ?', (photo_id,)).fetchone()[0]
+                self.db.execute('UPDATE photos SET path = ?, person_id = ? WHERE id = ?',
+                                (str(file), self.__person_id(full_name, role), photo_id))
+                self.db.execute('DELETE FROM persons WHERE id = ? AND NOT EXISTS '
+                                '(SELECT 1 FROM photos WHERE person_id = persons.id)', (old_person_id,))
+        added_ids = self.add_photos([(full_name, role, file, encoding)
+                                     for (full_name, role, file), encoding in zip(added, encodings[len(changed):])])
+
+        removed_ids = [photo_id for photo_ids in missing.values() for photo_id in photo_ids]
+        for photo_id in removed_ids:
+            self.remove_photo(photo_id)
+        return SyncResult(kept, added_ids, [photo_id for photo_id, _ in changed],
+                          [photo_id for photo_id, _, _, _ in renamed], removed_ids)
@@ -1,8 +1,9 @@
 import nest_asyncio
-import re
-import glob
-import face_recognition
+import asyncio
+import io
 import os
+import re
+import tempfile
 
 from aiogram import types, executor, Bot, Dispatcher
 from aiogram.contrib.fsm_storage.memory import MemoryStorage
@@ -12,9 +13,11 @@ from aiogram.dispatcher import FSMContext
 
 from markups import main_menu, inline_menu, inline_edit_menu
 from config import API_TOKEN, HELP, users, bot_password
-from functions import load_photo_with_name, parse_filename, show_people
+from functions import load_photo_with_name, show_people, load_preview
+from enrollment import encode_photo
 import recognizer
 import config
+import app
 
 
 class ProfileStatesGroup(StatesGroup):
@@ -40,7 +43,9 @@ class ProfileStatesGroup(StatesGroup):
 
 nest_asyncio.apply()
 
-rec = recognizer.Main()
+# recognition is built only when the bot is run: with the spawn start method every process of gallery sync and every
+# recognition worker imports this module again
+rec = None
 storage = MemoryStorage()
 bot = Bot(API_TOKEN)
 dp = Dispatcher(bot=bot, storage=storage)
@@ -88,6 +93,15 @@ async def cmd_start(message: types.Message):
     await message.delete()
 
 
+@dp.message_handler(commands=['memory'])
+async def cmd_memory(message: types.Message):
+    report = rec.rec.memory_report()
+    rss = f"{report['rss_bytes'] / 2 ** 20:.1f} МБ" if report['rss_bytes'] is not None else "неизвестно"
+    await message.answer(f"Фото в базе: {report['photos']}\n"
+                         f"Индекс лиц: {report['index_bytes'] / 2 ** 20:.2f} МБ\n"
+                         f"Память процесса: {rss}", reply_markup=main_menu)
+
+
 # --------------------------------------------Добавление фото-----------------------------------------------------------
 @dp.message_handler(Text(equals="Добавить фото 📷"), state=[None, '*'])
 async def cmd_add(message: types.Message):
@@ -112,23 +126,30 @@ async def load_name(message: types.Message, state: FSMContext):
 
 @dp.message_handler(content_types=['photo'], state=ProfileStatesGroup.photo)
 async def load_photo(message: types.Message, state: FSMContext):
-    await message.photo[-1].download('uploaded/1.jpg')
-    image = face_recognition.load_image_file('uploaded/1.jpg')
-    enc = face_recognition.face_encodings(image)
-    if len(enc) > 1:
-        await message.answer(f"⚠️ В кадре больше 1 человека! Выберите другое фото!",
-                             reply_markup=inline_menu)
-    elif len(enc) == 0:
-        await message.answer(f"⚠️ Лицо не было распознано! Выберите другое фото!",
-                             reply_markup=inline_menu)
-    else:
-        async with state.proxy() as data:
-            fullname, role = data['name'].split('-')
-            path = load_photo_with_name('_'.join(fullname.split()) + '-' + role)
-            file = face_recognition.load_image_file(path)
-            rec.rec.add_photo(fullname, role, file)
-        await message.answer(f"Фото успешно добавлено")
-        await state.finish()
+    # every upload gets its own file, so photos sent by several operators at once don't overwrite each other
+    fd, uploaded = tempfile.mkstemp(suffix='.jpg', dir='uploaded')
+    os.close(fd)
+    try:
+        await message.photo[-1].download(uploaded)
+        # the photo is decoded and encoded once in a thread, the event loop keeps serving cameras and other users
+        enc, faces = await asyncio.get_running_loop().run_in_executor(None, encode_photo, uploaded)
+        if faces > 1:
+            await message.answer(f"⚠️ В кадре больше 1 человека! Выберите другое фото!",
+                                 reply_markup=inline_menu)
+        elif enc is None:
+            await message.answer(f"⚠️ Лицо не было распознано! Выберите другое фото!",
+                                 reply_markup=inline_menu)
+        else:
+            async with state.proxy() as data:
+                fullname, role = data['name'].split('-')
+                async with rec.rec.gallery_lock:
+                    path = load_photo_with_name('_'.join(fullname.split()) + '-' + role, uploaded)
+                    rec.rec.add_photo(fullname, role, enc, path)
+            await message.answer(f"Фото успешно добавлено")
+            await state.finish()
+    finally:
+        if os.path.exists(uploaded):
+            os.remove(uploaded)
 # --------------------------------------------Добавление фото-----------------------------------------------------------
 
 # --------------------------------------------Удаление фото-------------------------------------------------------------
@@ -136,8 +157,7 @@ async def load_photo(message: types.Message, state: FSMContext):
 
 @dp.message_handler(Text(equals="Удалить фото ✋🏻"))
 async def cmd_del(message: types.Message):
-    files = ["png", "jpg"]
-    people = glob.glob(f"people/*{files}")
+    people = rec.rec.gallery.photos()
     if len(people) > 0:
         await show_people(message, people, main_menu)
         await message.answer(f"Введите порядковый номер человека (от 1 до {len(people)}), которого хотите удалить",
@@ -146,7 +166,7 @@ async def cmd_del(message: types.Message):
 
         state = Dispatcher.get_current().current_state()
         async with state.proxy() as data:
-            data['people'] = people
+            data['people'] = [photo.id for photo in people]
     else:
         await message.answer("⚠️ Вы не добавляли фото людей!",
                              reply_markup=inline_menu)
@@ -164,10 +184,9 @@ async def del_photo(message: types.Message, state: FSMContext):
             await message.answer(f"⚠️ Число не попадает в интервал от 1 до {len(people)}",
                                  reply_markup=inline_menu)
         else:
-            rec.rec.del_photo(idx)
-            #shutil.move(people[idx], "deleted")
-            os.remove(people[idx])
-            await message.answer(f"Фото №{idx + 1}({people[idx][-4:]}) успешно удалено", reply_markup=main_menu)
+            async with rec.rec.gallery_lock:
+                rec.rec.del_photo(people[idx])
+            await message.answer(f"Фото №{idx + 1} успешно удалено", reply_markup=main_menu)
             await state.finish()
     else:
         await message.answer(
@@ -179,8 +198,7 @@ async def del_photo(message: types.Message, state: FSMContext):
 # --------------------------------------------Вывод всех фото----------------------------------------------------------
 @dp.message_handler(Text(equals="Вывести внесенных людей 👀"))
 async def cmd_show_all_people(message: types.Message):
-    files = ["png", "jpg"]
-    people = glob.glob(f"people/*{files}")
+    people = rec.rec.gallery.persons()
     if len(people) > 0:
         await show_people(message, people, main_menu)
     else:
@@ -191,12 +209,7 @@ async def cmd_show_all_people(message: types.Message):
 # --------------------------------------------Вывести человека с фото---------------------------------------------------
 @dp.message_handler(Text(equals="Вывести человека с фото 👁️"))
 async def cmd_show_person(message: types.Message):
-    files = ["png", "jpg"]
-    filenames = glob.glob(f"people/*{files}")
-    people = []
-    for filename in filenames:
-        if re.search('[А-ЯЁ][а-яё]+_[А-ЯЁ][а-яё]+-[А-ЯЁа-яё ]+.jpg', filename):
-            people.append(filename)
+    people = rec.rec.gallery.persons()
     if len(people) > 0:
         await show_people(message, people, main_menu)
         await message.answer(
@@ -206,7 +219,7 @@ async def cmd_show_person(message: types.Message):
 
         state = Dispatcher.get_current().current_state()
         async with state.proxy() as data:
-            data['people'] = people
+            data['people'] = [person.id for person in people]
     else:
         await message.answer("⚠️ Вы не добавляли фото людей!", reply_markup=main_menu)
 
@@ -223,15 +236,13 @@ async def show_person(message: types.Message, state: FSMContext):
             await message.answer(f"⚠️ Число не попадает в интервал от 1 до {len(unique_people)}",
                                  reply_markup=inline_menu)
         else:
-            files = ["png", "jpg"]
-            people = sorted(glob.glob(f"people/*{files}"), reverse=True)
-
-            current_person = unique_people[idx][:-4]
-            for person in people:
-                if current_person in person:
-                    with open(person, "rb") as photo:
-                        full_name, role = parse_filename(person)
-                        await message.answer_photo(photo, caption=f"{full_name} -- {role}")
+            for person_photo in rec.rec.gallery.photos(unique_people[idx]):
+                preview = load_preview(person_photo.path)
+                if preview is None:
+                    await message.answer(f"⚠️ Не удалось открыть фото {person_photo.path}")
+                    continue
+                await message.answer_photo(types.InputFile(io.BytesIO(preview)),
+                                           caption=f"{person_photo.full_name} -- {person_photo.role}")
             await state.finish()
     else:
         await message.answer(
@@ -244,8 +255,7 @@ async def show_person(message: types.Message, state: FSMContext):
 # --------------------------------------------Редактировать имя---------------------------------------------------------
 @dp.message_handler(Text(equals="Редактировать инф-ию о человеке 📝"))
 async def cmd_edit(message: types.Message):
-    files = ["png", "jpg"]
-    people = glob.glob(f"people/*{files}")
+    people = rec.rec.gallery.persons()
     if len(people) > 0:
         await show_people(message, people, main_menu)
         await message.answer(
@@ -255,7 +265,7 @@ async def cmd_edit(message: types.Message):
 
         state = Dispatcher.get_current().current_state()
         async with state.proxy() as data:
-            data['people'] = people
+            data['people'] = [person.id for person in people]
     else:
         await message.answer("⚠️ Вы не добавляли фото людей!",
                              reply_markup=inline_menu)
@@ -274,7 +284,7 @@ async def select_person(message: types.Message, state: FSMContext):
                                  reply_markup=inline_menu)
         else:
             async with state.proxy() as data:
-                data['edit_name'] = people[idx]
+                data['edit_person'] = people[idx]
             await message.answer("Выберете, что вы хотите изменить",
                                  reply_markup=inline_edit_menu)
     else:
@@ -287,8 +297,9 @@ async def select_person(message: types.Message, state: FSMContext):
 async def edit_person_name(message: types.Message, state: FSMContext):
     if re.fullmatch(r'[А-ЯЁ][а-яё]+ [А-ЯЁ][а-яё]+-[А-ЯЁа-яё ]+', message.text):
         async with state.proxy() as data:
-            edit_name = data['edit_name']
-            os.rename(edit_name, 'people/' + '_'.join(message.text.split()) + '.jpg')
+            fullname, role = message.text.split('-')
+            async with rec.rec.gallery_lock:
+                rec.rec.rename_person(data['edit_person'], fullname, role)
 
         await message.answer("Имя изменено!")
         await state.finish()
@@ -358,7 +369,8 @@ async def cmd_start_rec(message: types.Message):
     try:
         rec.rec.connect_obs()
         rec.rec.set_star_title()
-        await message.answer("Введите uri вашей камеры (Пример: rtsp://192.168.1.11:554/live)",
+        await message.answer("Введите uri вашей камеры (Пример: rtsp://192.168.1.11:554/live). "
+                             "Для нескольких камер введите uri через пробел",
                              reply_markup=inline_menu)
         await ProfileStatesGroup.uri.set()
     except Exception as e:
@@ -369,10 +381,8 @@ async def cmd_start_rec(message: types.Message):
 async def start_rec(message: types.Message, state: FSMContext):
     await ProfileStatesGroup.next()
     await message.answer("Распознавание началось", reply_markup=main_menu)
-    if message.text == '0':
-        await rec.start(0)
-    else:
-        await rec.start(message.text)
+    uris = [0 if uri == '0' else uri for uri in message.text.split()]
+    await rec.start(uris)
 
 
 # --------------------------------------------Начать распознавание-----------------------------------------------------
@@ -394,6 +404,14 @@ async def cmd_start(message: types.Message):
                          reply_markup=main_menu)
 
 
+async def on_startup(dispatcher: Dispatcher):
+    if config.api_port:
+        asyncio.ensure_future(app.serve(rec, config.api_host, config.api_port))
+    if config.gallery_watch_interval:
+        asyncio.ensure_future(rec.rec.watch_gallery(config.gallery_watch_interval))
+
+
 if __name__ == '__main__':
+    rec = recognizer.Main()
     executor.start_polling(dp,
-                           skip_updates=True)
+                           skip_updates=True, on_startup=on_startup)
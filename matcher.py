@@ -0,0 +1,158 @@
+import copy
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from face_index import FlatIndex, IVFIndex
+
+
+class Match(NamedTuple):
+    id: Optional[int]
+    distance: float
+    candidates: List[Tuple[int, float]]
+
+
+class FaceMatcher:
+    tolerance: float
+    shortlist: int
+    index: Union[FlatIndex, IVFIndex]
+    embeddings: Dict[int, np.ndarray]
+
+    def __init__(self, tolerance: float = 0.6, index: Union[FlatIndex, IVFIndex] = None, shortlist: int = 5) -> None:
+        """
+        Constructor creates matcher of people that can have several photos. A query is first compared with one
+        centroid per person in the index, then people from the shortlist are re-ranked by their closest photo
+
+        :param tolerance: maximal euclidean distance between encodings of the same person
+        :param index: face index the centroids are searched in, exact FlatIndex by default
+        :param shortlist: number of people whose photos are compared with the query
+        """
+        self.tolerance = tolerance
+        self.shortlist = shortlist
+        self.index = index if index is not None else FlatIndex()
+        self.embeddings = dict()
+        self.photo_ids = dict()
+        self.person_of = dict()
+
+    def __len__(self) -> int:
+        return len(self.person_of)
+
+    def __contains__(self, photo_id: int) -> bool:
+        return photo_id in self.person_of
+
+    @property
+    def nbytes(self) -> int:
+        return self.index.nbytes + sum(embeddings.nbytes for embeddings in self.embeddings.values())
+
+    def copy(self) -> 'FaceMatcher':
+        """
+        Method returns an independent copy that can be changed while this matcher keeps serving queries. Encodings
+        of people are never changed in place, so they are shared, only the index is copied
+        """
+        matcher = FaceMatcher(self.tolerance, copy.deepcopy(self.index), self.shortlist)
+        matcher.embeddings = dict(self.embeddings)
+        matcher.photo_ids = {person_id: list(photo_ids) for person_id, photo_ids in self.photo_ids.items()}
+        matcher.person_of = dict(self.person_of)
+        return matcher
+
+    def __update_centroids(self, person_ids) -> None:
+        added_ids, centroids = [], []
+        for person_id in person_ids:
+            if person_id in self.index:
+                self.index.remove(person_id)
+            if person_id in self.embeddings:
+                added_ids.append(person_id)
+                centroids.append(self.embeddings[person_id].mean(axis=0))
+        if added_ids:
+            self.index.add(added_ids, np.stack(centroids))
+
+    def add_many(self, photo_ids: Sequence[int], person_ids: Sequence[int],
+                 encodings: Union[np.ndarray, Sequence[np.ndarray]]) -> None:
+        """
+        Method adds photos of people, centroids of every affected person are updated once
+
+        :param photo_ids: ids of the photos
+        :param person_ids: ids of people on the photos
+        :param encodings: 128-d face encodings of the photos
+        """
+        encodings = np.atleast_2d(np.asarray(encodings, dtype=np.float32))
+        grouped = dict()
+        for photo_id, person_id, encoding in zip(photo_ids, person_ids, encodings):
+            grouped.setdefault(person_id, ([], []))
+            grouped[person_id][0].append(photo_id)
+            grouped[person_id][1].append(encoding)
+            self.person_of[photo_id] = person_id
+
+        for person_id, (ids, person_encodings) in grouped.items():
+            if person_id in self.embeddings:
+                self.embeddings[person_id] = np.vstack([self.embeddings[person_id], np.stack(person_encodings)])
+                self.photo_ids[person_id].extend(ids)
+            else:
+                self.embeddings[person_id] = np.stack(person_encodings)
+                self.photo_ids[person_id] = list(ids)
+        self.__update_centroids(grouped.keys())
+
+    def add(self, photo_id: int, person_id: int, encoding: np.ndarray) -> None:
+        self.add_many([photo_id], [person_id], encoding)
+
+    def remove(self, photo_id: int) -> None:
+        """
+        Method removes a photo, a person without photos is removed from the index
+
+        :param photo_id: id of the photo
+        """
+        person_id = self.person_of.pop(photo_id)
+        row = self.photo_ids[person_id].index(photo_id)
+        self.photo_ids[person_id].pop(row)
+        self.embeddings[person_id] = np.delete(self.embeddings[person_id], row, axis=0)
+        if not self.photo_ids[person_id]:
+            del self.photo_ids[person_id], self.embeddings[person_id]
+        self.__update_centroids([person_id])
+
+    def merge(self, person_id: int, into_id: int) -> None:
+        """
+        Method moves all photos of a person to another person
+
+        :param person_id: id of the person whose photos are moved
+        :param into_id: id of the person that receives the photos
+        """
+        if person_id not in self.embeddings or person_id == into_id:
+            return
+        photo_ids, embeddings = self.photo_ids.pop(person_id), self.embeddings.pop(person_id)
+        for photo_id in photo_ids:
+            del self.person_of[photo_id]
+        self.__update_centroids([person_id])
+        self.add_many(photo_ids, [into_id] * len(photo_ids), embeddings)
+
+    def match(self, queries: Union[np.ndarray, Sequence[np.ndarray]], k: int = 1) -> List[Match]:
+        """
+        Method finds the closest known people for all faces of a frame at once: every face shortlists people by
+        distance to their centroids, then distances between all faces and all photos of the shortlisted people are
+        computed as one matrix and reduced to the closest photo of each person
+
+        :param queries: one encoding or a batch of encodings
+        :param k: number of candidates to return for each query
+        :return: list of matches, id of a match is a person id or None if the closest photo is farther than tolerance
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        _, shortlists = self.index.search(queries, max(k, self.shortlist))
+        people = np.unique(shortlists[shortlists >= 0])
+        if len(people) == 0:
+            return [Match(None, float('inf'), []) for _ in queries]
+
+        embeddings = [self.embeddings[person_id] for person_id in people.tolist()]
+        starts = np.cumsum([0] + [len(person_embeddings) for person_embeddings in embeddings[:-1]])
+        photos = np.concatenate(embeddings)
+        sq_distances = np.einsum('ij,ij->i', queries, queries)[:, None] + np.einsum('ij,ij->i', photos, photos)[None, :]
+        sq_distances -= 2 * (queries @ photos.T)
+        # faces x people matrix of distances to the closest photo of every person
+        distances = np.sqrt(np.maximum(np.minimum.reduceat(sq_distances, starts, axis=1), 0))
+
+        top = min(k, len(people))
+        order = np.argsort(distances, axis=1)[:, :top]
+        matches = []
+        for row, columns in zip(distances, order):
+            candidates = [(int(people[column]), float(row[column])) for column in columns]
+            best, distance = candidates[0]
+            matches.append(Match(best if distance <= self.tolerance else None, distance, candidates))
+        return matches
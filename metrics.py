@@ -0,0 +1,167 @@
+import threading
+import time
+from bisect import bisect_left
+from typing import Dict, List, Sequence, Tuple
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+# seconds, from a fraction of a millisecond for matching up to seconds for a stalled stream
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+registry: List['Metric'] = []
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class Metric:
+    name: str
+    documentation: str
+    labels: Tuple[str, ...]
+    kind: str = ''
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()) -> None:
+        """
+        Constructor creates a metric and registers it for export in Prometheus text format
+
+        :param name: metric name
+        :param documentation: help text
+        :param labels: names of labels, their values are passed positionally on every update
+        """
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def _labels(self, values: Tuple[str, ...], extra: str = '') -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        return '\n'.join([f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+                         + self.samples())
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labels)
+        self.values: Dict[Tuple[str, ...], float] = dict()
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            values = list(self.values.items())
+        return [f'{self.name}{self._labels(labels)} {value}' for labels, value in values]
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labels)
+        self.values: Dict[Tuple[str, ...], float] = dict()
+
+    def set(self, value: float, *labels: str) -> None:
+        with self.lock:
+            self.values[labels] = value
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            values = list(self.values.items())
+        return [f'{self.name}{self._labels(labels)} {value}' for labels, value in values]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        """
+        Constructor creates a histogram with fixed buckets. An observation costs one binary search and a few integer
+        increments, cumulative bucket counts are computed only when the metrics are scraped
+
+        :param name: metric name
+        :param documentation: help text
+        :param labels: names of labels
+        :param buckets: sorted upper bounds of buckets
+        """
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+        self.values: Dict[Tuple[str, ...], list] = dict()
+
+    def observe(self, value: float, *labels: str) -> None:
+        with self.lock:
+            series = self.values.get(labels)
+            if series is None:
+                series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+
+    def time(self, *labels: str) -> 'Timer':
+        return Timer(self, labels)
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            values = [(labels, list(counts), total) for labels, (counts, total) in self.values.items()]
+        lines = []
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float('inf') else f'le="{bound!r}"'
+                lines.append(f'{self.name}_bucket{self._labels(labels, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{self._labels(labels)} {total}')
+            lines.append(f'{self.name}_count{self._labels(labels)} {cumulative}')
+        return lines
+
+
+class Timer:
+
+    def __init__(self, histogram: Histogram, labels: Tuple[str, ...]) -> None:
+        self.histogram = histogram
+        self.labels = labels
+        self.start = 0.0
+
+    def __enter__(self) -> 'Timer':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+
+
+def render() -> str:
+    """
+    Function returns all registered metrics in Prometheus text exposition format
+    """
+    return '\n'.join(metric.render() for metric in registry) + '\n'
+
+
+stage_seconds = Histogram('autocaption_stage_seconds',
+                          'Time spent in each stage of the recognition hot path, grab is mostly waiting for the next '
+                          'frame of the stream, capture_age is the time between capturing a frame and starting its '
+                          'processing', ('camera', 'stage'))
+publish_seconds = Histogram('autocaption_publish_seconds', 'Time of a caption update sent to OBS or CasparCG until '
+                                                           'its response', ('target',))
+frames_total = Counter('autocaption_frames_total', 'Frames by result: processed, skipped_budget, skipped_unchanged '
+                                                   'or dropped by capture', ('camera', 'result'))
+faces_total = Counter('autocaption_faces_total', 'Faces by result: matched, unknown or rejected_<reason> by the '
+                                                 'quality gate', ('camera', 'result'))
+publish_errors_total = Counter('autocaption_publish_errors_total', 'Failed caption updates and connections',
+                               ('target',))
+scheduler_setting = Gauge('autocaption_scheduler_setting', 'Current recognition settings of the adaptive scheduler: '
+                                                          'level, fps, scale and upsample', ('setting',))
+scheduler_changes_total = Counter('autocaption_scheduler_changes_total', 'Decisions of the adaptive scheduler by '
+                                                                         'reason: latency, cpu or headroom',
+                                  ('reason',))
@@ -0,0 +1,52 @@
+import time
+from typing import Optional
+
+import cv2
+import numpy as np
+
+
+class SceneChangeGate:
+    threshold: float
+    max_interval: float
+    processed: int
+    skipped: int
+
+    def __init__(self, threshold: float = 4.0, max_interval: float = 2.0, size=(64, 36)) -> None:
+        """
+        Constructor creates a cheap pre-filter that lets frames through to recognition only when the scene changed
+
+        :param threshold: mean absolute difference of downsampled grayscale frames (0-255) that counts as a change
+        :param max_interval: maximal time in seconds between two processed frames, even if the scene is static
+        :param size: size of the downsampled frames that are compared
+        """
+        self.threshold = threshold
+        self.max_interval = max_interval
+        self.size = size
+        self.reference = None
+        self.last_processed = 0.0
+        self.processed = 0
+        self.skipped = 0
+
+    def should_process(self, frame: np.ndarray, now: Optional[float] = None) -> bool:
+        """
+        Method compares a BGR frame with the last processed one
+
+        :param frame: BGR frame from the capture
+        :param now: current time, time.monotonic() by default
+        :return: True if the frame should go to recognition
+        """
+        now = time.monotonic() if now is None else now
+        thumb = cv2.cvtColor(cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+
+        changed = self.reference is None or cv2.absdiff(thumb, self.reference).mean() >= self.threshold
+        if changed or now - self.last_processed >= self.max_interval:
+            self.reference = thumb
+            self.last_processed = now
+            self.processed += 1
+            return True
+
+        self.skipped += 1
+        return False
+
+    def reset(self) -> None:
+        self.reference = None
@@ -0,0 +1,166 @@
+import asyncio
+import base64
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Optional
+
+import websockets
+
+import metrics
+
+
+class ObsClient:
+    host: str
+    port: int
+    connected: bool
+
+    def __init__(self, host: str, port: int, password: Optional[str] = None, max_pending: int = 32,
+                 min_backoff: float = 0.5, max_backoff: float = 10.0, timeout: float = 5.0) -> None:
+        """
+        Constructor creates an asyncio client for obs-websocket v5. Updates are queued without blocking, only the
+        latest settings of every input are kept, and all queued updates are sent in one RequestBatch
+
+        :param host: OBS host
+        :param port: obs-websocket port
+        :param password: obs-websocket password or None if authentication is disabled
+        :param max_pending: maximal number of inputs with queued updates, the oldest update is dropped above it
+        :param min_backoff: delay in seconds before the first reconnect attempt
+        :param max_backoff: maximal delay in seconds between reconnect attempts
+        :param timeout: time in seconds to wait for a response of OBS
+        """
+        self.host = host
+        self.port = port
+        self.password = password
+        self.max_pending = max_pending
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+
+        self.pending = OrderedDict()
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.connected = False
+        self.request_id = 0
+
+        self.sent = 0
+        self.batches = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.errors = 0
+        self.reconnects = 0
+
+    def start(self) -> None:
+        """
+        Method starts the connection task in the running event loop
+        """
+        if self.task is None or self.task.done():
+            self.task = asyncio.ensure_future(self.run())
+
+    def stop(self) -> None:
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        self.connected = False
+
+    def set_input_settings(self, input_name: str, settings: dict) -> None:
+        """
+        Method queues SetInputSettings request, a queued update of the same input is replaced
+
+        :param input_name: name of the OBS input
+        :param settings: input settings
+        """
+        if input_name in self.pending:
+            self.coalesced += 1
+            self.pending.move_to_end(input_name)
+        self.pending[input_name] = settings
+        while len(self.pending) > self.max_pending:
+            self.pending.popitem(last=False)
+            self.dropped += 1
+        self.wakeup.set()
+
+    def set_text(self, input_name: str, text: str) -> None:
+        self.set_input_settings(input_name, {"text": text})
+
+    async def run(self) -> None:
+        """
+        Method keeps the connection to OBS alive, reconnecting with exponential backoff, and sends queued updates
+        """
+        delay = self.min_backoff
+        while True:
+            try:
+                async with websockets.connect(f'ws://{self.host}:{self.port}',
+                                              subprotocols=['obswebsocket.json']) as ws:
+                    await self.__identify(ws)
+                    self.connected = True
+                    delay = self.min_backoff
+                    await self.__send_loop(ws)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                metrics.publish_errors_total.inc('obs')
+                print(f'OBS connection error: {e!r}')
+            finally:
+                self.connected = False
+
+            self.reconnects += 1
+            await asyncio.sleep(delay)
+            delay = min(2 * delay, self.max_backoff)
+
+    async def __receive(self, ws, op: int) -> dict:
+        while True:
+            message = json.loads(await asyncio.wait_for(ws.recv(), self.timeout))
+            if message['op'] == op:
+                return message['d']
+
+    async def __identify(self, ws) -> None:
+        hello = await self.__receive(ws, 0)
+        identify = {'rpcVersion': 1, 'eventSubscriptions': 0}
+        auth = hello.get('authentication')
+        if auth is not None:
+            secret = base64.b64encode(hashlib.sha256(((self.password or '') + auth['salt']).encode()).digest())
+            identify['authentication'] = base64.b64encode(
+                hashlib.sha256(secret + auth['challenge'].encode()).digest()).decode()
+        await ws.send(json.dumps({'op': 1, 'd': identify}))
+        await self.__receive(ws, 2)
+
+    async def __send_loop(self, ws) -> None:
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+            if not self.pending:
+                continue
+
+            batch, self.pending = self.pending, OrderedDict()
+            self.request_id += 1
+            request_id = str(self.request_id)
+            requests = [{'requestType': 'SetInputSettings',
+                         'requestData': {'inputName': input_name, 'inputSettings': settings}}
+                        for input_name, settings in batch.items()]
+            start = time.perf_counter()
+            try:
+                await ws.send(json.dumps({'op': 8, 'd': {'requestId': request_id, 'haltOnFailure': False,
+                                                         'executionType': 0, 'requests': requests}}))
+                while True:
+                    response = await self.__receive(ws, 9)
+                    if response['requestId'] == request_id:
+                        break
+            except BaseException:
+                # updates that weren't replaced meanwhile are sent again after reconnect
+                for input_name, settings in batch.items():
+                    if input_name not in self.pending:
+                        self.pending[input_name] = settings
+                self.wakeup.set()
+                raise
+
+            metrics.publish_seconds.observe(time.perf_counter() - start, 'obs')
+            self.batches += 1
+            self.sent += len(requests)
+            for result in response.get('results', []):
+                status = result.get('requestStatus', {})
+                if not status.get('result', False):
+                    self.errors += 1
+                    metrics.publish_errors_total.inc('obs')
+                    print(f"OBS request {result.get('requestType')} failed: {status.get('comment')}")
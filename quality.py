@@ -0,0 +1,69 @@
+from typing import NamedTuple, Optional, Tuple
+
+import cv2
+import face_recognition
+import numpy as np
+
+REASONS = ('small', 'dark', 'bright', 'blurry', 'profile')
+
+
+class FaceQuality(NamedTuple):
+    min_size: int = 40
+    min_sharpness: float = 25.0
+    min_brightness: float = 40.0
+    max_brightness: float = 220.0
+    max_yaw: Optional[float] = 0.4
+
+
+def estimate_yaw(image: np.ndarray, location: Tuple[int, int, int, int]) -> Optional[float]:
+    """
+    Function estimates how much a face is turned sideways from the 5-point landmarks: offset of the nose tip from
+    the middle of the eyes relative to the distance between the eyes. It is about 0 for a frontal face and grows
+    towards profile
+
+    :param image: RGB image
+    :param location: face location in (top, right, bottom, left) order
+    :return: signed yaw ratio or None if landmarks weren't found
+    """
+    landmarks = face_recognition.face_landmarks(image, [location], model='small')
+    if not landmarks:
+        return None
+    landmarks = landmarks[0]
+    left_eye = np.mean(landmarks['left_eye'], axis=0)
+    right_eye = np.mean(landmarks['right_eye'], axis=0)
+    nose = np.mean(landmarks['nose_tip'], axis=0)
+    eyes_distance = abs(right_eye[0] - left_eye[0])
+    return float((nose[0] - (left_eye[0] + right_eye[0]) / 2) / max(eyes_distance, 1.0))
+
+
+def check_face(image: np.ndarray, location: Tuple[int, int, int, int], quality: FaceQuality) -> Optional[str]:
+    """
+    Function decides whether a face is worth encoding. Checks go from the cheapest to the most expensive one: size,
+    exposure and Laplacian variance sharpness on a 64x64 grayscale crop, then yaw from landmarks
+
+    :param image: RGB image
+    :param location: face location in (top, right, bottom, left) order
+    :param quality: thresholds
+    :return: None if the face passes or the reason it is rejected, one of REASONS
+    """
+    top, right, bottom, left = location
+    if min(bottom - top, right - left) < quality.min_size:
+        return 'small'
+
+    crop = image[max(0, top):bottom, max(0, left):right]
+    if crop.size == 0:
+        return 'small'
+    gray = cv2.resize(cv2.cvtColor(crop, cv2.COLOR_RGB2GRAY), (64, 64), interpolation=cv2.INTER_AREA)
+    brightness = gray.mean()
+    if brightness < quality.min_brightness:
+        return 'dark'
+    if brightness > quality.max_brightness:
+        return 'bright'
+    if cv2.Laplacian(gray, cv2.CV_64F).var() < quality.min_sharpness:
+        return 'blurry'
+
+    if quality.max_yaw is not None:
+        yaw = estimate_yaw(image, location)
+        if yaw is None or abs(yaw) > quality.max_yaw:
+            return 'profile'
+    return None
@@ -1,22 +1,42 @@
 from __future__ import annotations
 import cv2
 import numpy as np
-import face_recognition
-from typing import List, Union
+from typing import Dict, List, Union
 from pathlib import Path
 
-from amcp_pylib.core import Client
-from amcp_pylib.module.template import CG_ADD
-from obswebsocket import obsws, requests
+from obs_client import ObsClient
+from caspar import CasparTitle, template_data
 
 from typing import Tuple
 import asyncio
 
+import os
 import threading
 import keyboard
 import time
 
-from config import port, host, password
+import config
+import metrics
+from config import gallery_path, match_tolerance, match_shortlist, face_index, face_index_params, \
+    recognition_worker, detection_scale, detection_upsample, scene_change_threshold, scene_max_interval, \
+    camera_fps_budget, camera_rois, caption_inputs, caption_switch_frames, caption_min_hold, caption_clear_after, \
+    caption_policy, \
+    adaptive_scheduler, adaptive_latency, adaptive_cpu_budget, adaptive_min_fps, adaptive_min_scale, \
+    adaptive_interval, \
+    caspar_host, caspar_port, caspar_channel, caspar_layer, caspar_template, \
+    face_min_size, face_min_sharpness, face_brightness_range, face_max_yaw
+from gallery import GalleryStore
+from functions import rss_bytes
+from matcher import FaceMatcher
+from face_index import make_index
+from quality import FaceQuality, REASONS
+from enrollment import parse_filename, encode_photos
+from worker import RecognitionWorker, InlineWorker, WorkerStopped
+from motion import SceneChangeGate
+from captions import CaptionController, select_on_air
+from scheduler import AdaptiveScheduler, quality_levels
+
+face_quality = FaceQuality(face_min_size, face_min_sharpness, *face_brightness_range, face_max_yaw)
 
 
 
@@ -61,12 +81,45 @@ class BoundingBox:
         """
         return self.x_left, self.y_top, self.x_right, self.y_bottom
 
+    def location(self) -> Tuple[int, int, int, int]:
+        """
+        Method returns bounding box in the face_recognition (top, right, bottom, left) format
+
+        :return: y of top side; x of right side; y of bottom side; x of left side
+        """
+        return self.y_top, self.x_right, self.y_bottom, self.x_left
+
+    @staticmethod
+    def from_location(location: Tuple[int, int, int, int]) -> BoundingBox:
+        """
+        Method creates a BoundingBox from the face_recognition (top, right, bottom, left) format
+
+        :param location: face location returned by face_recognition
+        :return: BoundingBox object
+        """
+        top, right, bottom, left = location
+        return BoundingBox((left, top), right - left, bottom - top)
+
+    def shifted(self, dx: float, dy: float) -> BoundingBox:
+        return BoundingBox((self.x_left + dx, self.y_top + dy), self.width, self.height)
+
+    def iou(self, other: BoundingBox) -> float:
+        """
+        Method calculates intersection over union with another bounding box
+
+        :param other: BoundingBox object
+        :return: IoU from 0 to 1
+        """
+        width = min(self.x_right, other.x_right) - max(self.x_left, other.x_left)
+        height = min(self.y_bottom, other.y_bottom) - max(self.y_top, other.y_top)
+        if width <= 0 or height <= 0:
+            return 0.0
+        intersection = width * height
+        return intersection / (self.width * self.height + other.width * other.height - intersection)
+
 
 class Person:
     max_unseen_frames = 20
-    id_availability = dict()
-    for possible_id in range(1, 11):
-        id_availability[possible_id] = True
 
     id: int
     full_name: str
@@ -77,6 +130,9 @@ class Person:
     body_frame: np.ndarray
     confidence: float
     sorter_id: int
+    face_id: int
+    identity_confidence: float
+    velocity: Tuple[float, float]
 
     def __init__(self, frame: np.ndarray, body_bounding_box: BoundingBox, confidence: float) -> None:
         """
@@ -96,6 +152,9 @@ class Person:
         self.confidence = confidence
         self.last_seen = 0
         self.face_photo = None
+        self.face_id = None
+        self.identity_confidence = 0.0
+        self.velocity = (0.0, 0.0)
 
     def get_relative_faceBB(self) -> BoundingBox:
         """
@@ -108,30 +167,14 @@ class Person:
 
         return BoundingBox((x_face - x_body, y_face - y_body), width, height)
 
-    def set_id(self, new_id: int) -> None:
+    def predicted_bounding_box(self) -> BoundingBox:
         """
-        Method that updates id and sorter_id
+        Method predicts body bounding box on the next frame assuming constant velocity
 
-        :param new_id: an integer id to set
+        :return: BoundingBox object
         """
-        if self.id is None:
-            available_id = Person.__get_next_id()
-            if available_id is None:
-                print('Deleting person')
-                del self
-                return
-
-            self.id = available_id
-        self.sorter_id = new_id
-
-    @staticmethod
-    def __get_next_id():
-        for current_id in range(1, 11):
-            if Person.id_availability[current_id]:
-                Person.id_availability[current_id] = False
-                return current_id
-
-        return None
+        dx, dy = self.velocity
+        return self.body_bounding_box.shifted(dx * (self.last_seen + 1), dy * (self.last_seen + 1))
 
     def update_info(self, new_info: Person) -> None:
         """
@@ -146,8 +189,7 @@ class Person:
         self.confidence = new_info.confidence
         if new_info.id is not None and self.id is None:
             self.id = new_info.id
-        else:
-            self.set_id(new_info.sorter_id)
+        self.sorter_id = new_info.sorter_id
         self.last_seen = 0
 
     def get_middle_point(self) -> Tuple[int]:
@@ -160,216 +202,677 @@ class Person:
         return f'X: {self.body_bounding_box.x_left} Y: {self.body_bounding_box.y_top} W: {self.body_bounding_box.width} H: {self.body_bounding_box.height} | ID: {self.id if self.id is not None else "None"} ({self.sorter_id if self.sorter_id is not None else "None"}) | Conf: {self.confidence} | Name: {self.full_name if self.full_name is not None else "Unknown"}'
 
 
+class FaceTracker:
+    min_iou: float
+    identity_decay: float
+    min_identity_confidence: float
+    unknown_confidence: float
+    people: List[Person]
+
+    def __init__(self, min_iou: float = 0.3, identity_decay: float = 0.95, min_identity_confidence: float = 0.3,
+                 unknown_confidence: float = 0.5) -> None:
+        """
+        Constructor creates a tracker that associates detected faces with people from previous frames, so that faces
+        are encoded only when a new person appears or the identity of a tracked person has to be confirmed again
+
+        :param min_iou: minimal IoU between predicted and detected boxes to continue a track
+        :param identity_decay: factor the identity confidence of a person is multiplied by on every frame
+        :param min_identity_confidence: identity confidence below which a person is identified again
+        :param unknown_confidence: identity confidence given to a person that wasn't recognized
+        """
+        self.min_iou = min_iou
+        self.identity_decay = identity_decay
+        self.min_identity_confidence = min_identity_confidence
+        self.unknown_confidence = unknown_confidence
+        self.people = []
+        self.next_sorter_id = 1
+
+    def __associate(self, boxes: List[BoundingBox]) -> List[Tuple[int, int]]:
+        predicted = [person.predicted_bounding_box() for person in self.people]
+        pairs = []
+        for i, person_box in enumerate(predicted):
+            for j, box in enumerate(boxes):
+                score = person_box.iou(box)
+                if score < self.min_iou:
+                    # centroid fallback for fast motion: the centre moved less than half of the face size
+                    px, py = person_box.x_left + person_box.width / 2, person_box.y_top + person_box.height / 2
+                    bx, by = box.x_left + box.width / 2, box.y_top + box.height / 2
+                    distance = ((px - bx) ** 2 + (py - by) ** 2) ** 0.5
+                    if distance > max(person_box.width, person_box.height) / 2:
+                        continue
+                    score = self.min_iou * (1 - distance / max(person_box.width, person_box.height))
+                pairs.append((score, i, j))
+
+        assigned = []
+        used_people, used_boxes = set(), set()
+        for _, i, j in sorted(pairs, reverse=True):
+            if i not in used_people and j not in used_boxes:
+                used_people.add(i)
+                used_boxes.add(j)
+                assigned.append((i, j))
+        return assigned
+
+    def __free_id(self) -> int:
+        used = {person.id for person in self.people}
+        free_id = 1
+        while free_id in used:
+            free_id += 1
+        return free_id
+
+    def update(self, frame: np.ndarray, locations: List[Tuple[int, int, int, int]]) -> List[Person]:
+        """
+        Method updates tracked people with faces detected on a new frame
+
+        :param frame: RGB frame the faces were detected on
+        :param locations: face locations in (top, right, bottom, left) order
+        :return: list of people visible on the frame
+        """
+        boxes = [BoundingBox.from_location(location) for location in locations]
+        assigned = self.__associate(boxes)
+
+        visible = []
+        matched_boxes = set()
+        for i, j in assigned:
+            person = self.people[i]
+            detection = Person(frame, boxes[j], 1.0)
+            detection.face_bounding_box = boxes[j]
+            detection.sorter_id = person.sorter_id
+            (old_x, old_y), (new_x, new_y) = person.get_middle_point(), detection.get_middle_point()
+            steps = person.last_seen + 1
+            person.velocity = ((new_x - old_x) / steps, (new_y - old_y) / steps)
+            person.update_info(detection)
+            person.identity_confidence *= self.identity_decay
+            matched_boxes.add(j)
+            visible.append(person)
+
+        for person in self.people:
+            if person not in visible:
+                person.last_seen += 1
+        # ids belong to the tracker, a removed person frees its id for the next new one
+        self.people = [person for person in self.people if person.last_seen <= Person.max_unseen_frames]
+
+        for j, box in enumerate(boxes):
+            if j in matched_boxes:
+                continue
+            person = Person(frame, box, 1.0)
+            person.face_bounding_box = box
+            person.id = self.__free_id()
+            person.sorter_id = self.next_sorter_id
+            self.next_sorter_id += 1
+            self.people.append(person)
+            visible.append(person)
+
+        visible.sort(key=lambda person: person.sorter_id)
+        return visible
+
+    def needs_identification(self, people: List[Person]) -> List[Person]:
+        """
+        Method selects people whose faces have to be encoded and matched
+
+        :param people: people visible on the current frame
+        :return: new people and people with decayed identity confidence
+        """
+        return [person for person in people if person.identity_confidence < self.min_identity_confidence]
+
+    def set_identity(self, person: Person, face_id, full_name: str = None, role: str = None) -> None:
+        """
+        Method stores the result of identification of a person
+
+        :param person: identified person
+        :param face_id: id of the recognized person in the gallery or None if the person wasn't recognized
+        :param full_name: full name of the matched person
+        :param role: role of the matched person
+        """
+        person.face_id = face_id
+        person.full_name = full_name
+        person.role = role
+        person.identity_confidence = 1.0 if face_id is not None else self.unknown_confidence
+
+    def reset(self) -> None:
+        self.people = []
+
+
 class Recognizer:
-    face_images: List[np.ndarray]
-    face_names: List[Tuple[str, str]]
-    face_encodings: List[np.ndarray]
+    gallery: GalleryStore
+    face_names: Dict[int, Tuple[str, str]]
+    template_data: Dict[int, str]
+    matcher: FaceMatcher
     
-    def __init__(self) -> None:
+    def __init__(self, sync: bool = True) -> None:
         """
-        Constructor reads directory containing known faces, generates encodings and parses names and roles for them
+        Constructor opens the gallery of known people, adds photos that appeared in the people directory and loads
+        face encodings into the matcher. Photos that didn't change since the previous start aren't encoded again
+
+        :param sync: sync the gallery with the people directory, worker processes only load what is already stored
         """
 
         self.text = ''
-        self.face_images = []
-        self.face_names = []
+        self.face_names = dict()
+        self.template_data = dict()
+        self.matcher = FaceMatcher(match_tolerance, make_index(face_index, **face_index_params), match_shortlist)
         self.recognized_people = set()
 
-        self.__read_images()
-        
-        self.face_encodings = [face_recognition.face_encodings(x)[0] for x in self.face_images]
+        self.gallery = GalleryStore(gallery_path)
+        # held while the gallery is changed, so a reload and the bot don't change it at the same time
+        self.gallery_lock = asyncio.Lock()
+        self.__read_images(sync)
         
-        self.client = Client()
-        self.client.connect()
+        self.caspar = CasparTitle(caspar_host, caspar_port, caspar_channel, caspar_layer, caspar_template)
         
-        self.ws = None
+        self.obs = None
+
+    def __read_images(self, sync: bool = True):
+        kept = encoded = removed = 0
+        if sync:
+            faces_dir = Path("people")
+            faces_dir.mkdir(parents=True, exist_ok=True)
+            result = self.gallery.sync_directory(faces_dir, parse_filename, encode_photos)
+            kept, encoded, removed = result.kept, len(result.added) + len(result.changed), len(result.removed)
+        for person in self.gallery.persons():
+            self.__set_person(person.id, person.full_name, person.role)
+        photo_ids, person_ids, encodings = [], [], []
+        for photo_id, person_id, encoding in self.gallery.encodings():
+            photo_ids.append(photo_id)
+            person_ids.append(person_id)
+            encodings.append(encoding)
+        if encodings:
+            self.matcher.add_many(photo_ids, person_ids, np.stack(encodings))
+        print(f'Loaded {len(self.matcher)} faces ({kept} unchanged, {encoded} encoded, {removed} removed)')
 
-    def __read_images(self):
-        faces_dir = Path("people")
-        faces_dir.mkdir(parents=True, exist_ok=True)
+    def __synced_gallery(self):
+        """
+        Method syncs the gallery with the people directory and applies the changes to copies of the matcher and of
+        the names, the live ones keep serving recognition meanwhile. The matcher is compared with the database, not
+        only with the result of the sync, because photos may be stored by another process, e.g. by enrollment.py
 
-        for file in faces_dir.iterdir():
-            fullname, role = Recognizer.__parse_filename(file.name)
+        :return: new matcher, names and template data or None if nothing changed
+        """
+        result = self.gallery.sync_directory(Path("people"), parse_filename, encode_photos)
+        stored = {photo.id: photo.person_id for photo in self.gallery.photos()}
+        live = self.matcher.person_of
+        # photos new to the matcher, moved to another person or encoded again under the same id
+        reload = {photo_id for photo_id, person_id in stored.items() if live.get(photo_id) != person_id}
+        reload.update(photo_id for photo_id in result.changed if photo_id in stored)
+        remove = [photo_id for photo_id in live if photo_id not in stored or photo_id in reload]
+
+        people = self.gallery.persons()
+        face_names = {person.id: (person.full_name, person.role) for person in people}
+        if not reload and not remove and face_names == self.face_names:
+            return None
+
+        matcher = self.matcher.copy()
+        for photo_id in remove:
+            matcher.remove(photo_id)
+        photo_ids, person_ids, encodings = [], [], []
+        for photo_id, person_id, encoding in self.gallery.encodings(sorted(reload)):
+            photo_ids.append(photo_id)
+            person_ids.append(person_id)
+            encodings.append(encoding)
+        if encodings:
+            matcher.add_many(photo_ids, person_ids, np.stack(encodings))
 
-            if fullname is None or role is None:
-                continue
+        print(f'Gallery reloaded: {len(reload)} photos loaded, {len(remove)} unloaded '
+              f'({len(result.added)} added, {len(result.changed)} changed, {len(result.renamed)} renamed, '
+              f'{len(result.removed)} removed in the people directory)')
+        return (matcher, face_names,
+                {person.id: template_data(person.full_name, person.role) for person in people})
 
-            self.face_names.append((fullname, role))
-            self.face_images.append(face_recognition.load_image_file(file))
+    async def reload(self) -> None:
+        """
+        Method applies photos added, changed, renamed or removed in the people directory to the live gallery. New
+        photos are encoded in a thread and the new matcher replaces the old one in a single assignment
+        """
+        async with self.gallery_lock:
+            synced = await asyncio.get_running_loop().run_in_executor(None, self.__synced_gallery)
+            if synced is not None:
+                self.matcher, self.face_names, self.template_data = synced
 
-    @staticmethod
-    def __parse_filename(filename):
-        img_extensions = ['jpg', 'jpeg', 'png', 'bmp']
-        file_name_parts = filename.split('.')
-        file_ext = file_name_parts[-1]
-
-        if len(file_name_parts) != 2:
-            print(f'File named incorrectly: {filename}')
-            return None, None
-
-        if file_ext not in img_extensions:
-            print(f'Unsupported file type: {file_ext}')
-            return None, None
-
-        person_name_parts = file_name_parts[0].split('-')
-        if len(person_name_parts) < 2 or len(person_name_parts) > 3:
-            print(f'File named incorrectly: {filename}')
-            return None, None
-
-        if len(person_name_parts) == 3:
-            person_name_parts = person_name_parts[:2]
-
-        full_name, role = person_name_parts
-        full_name = " ".join(full_name.split('_'))
-        role = " ".join(role.split('_'))
-        return full_name, role
-    
-    def add_photo(self, full_name, role, file):
-        self.face_images.append(file)
-        self.face_names.append((full_name, role))
-        enc = face_recognition.face_encodings(file)[0]
-        self.face_encodings.append(enc)
+    async def watch_gallery(self, interval: float = 2.0) -> None:
+        """
+        Method watches the people directory and reloads the gallery when files appear, change or disappear
+
+        :param interval: time in seconds between checks of the directory
+        """
+        def snapshot():
+            with os.scandir("people") as entries:
+                return {entry.name: (entry.stat().st_mtime_ns, entry.stat().st_size)
+                        for entry in entries if entry.is_file()}
 
-    def del_photo(self, num):
-        self.face_images.pop(num)
-        self.face_names.pop(num)
-        self.face_encodings.pop(num)
+        # the first check always syncs, photos may have appeared since the gallery was loaded
+        previous = None
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                current = snapshot()
+                if current != previous:
+                    await self.reload()
+                previous = current
+            except Exception as e:
+                print(f'Gallery reload failed: {e!r}')
+
+    def __set_person(self, person_id, full_name, role):
+        self.face_names[person_id] = (full_name, role)
+        self.template_data[person_id] = template_data(full_name, role)
+
+    def add_photo(self, full_name, role, enc, path):
+        """
+        Method adds a photo of a person to the gallery and to the matcher
 
-    def set_star_title(self):
-        self.ws.call(requests.SetInputSettings(inputName="detected_name",
-                                               inputSettings={"text": f"Тут будет человек!"}))
+        :param full_name: full name of the person
+        :param role: role of the person
+        :param enc: face encoding computed when the photo was checked
+        :param path: path the photo is saved to
+        :return: photo id
+        """
+        person_id = self.gallery.get_or_add_person(full_name, role)
+        photo_id = self.gallery.add_photo(person_id, Path(path), enc)
+        self.__set_person(person_id, full_name, role)
+        self.matcher.add(photo_id, person_id, enc)
+        return photo_id
+
+    def del_photo(self, photo_id):
+        """
+        Method removes a photo from the gallery, the matcher and the disk
+
+        :param photo_id: id of the photo
+        """
+        photo = self.gallery.remove_photo(photo_id)
+        if photo is None:
+            return
+        if photo_id in self.matcher:
+            self.matcher.remove(photo_id)
+        if self.gallery.person(photo.person_id) is None:
+            self.face_names.pop(photo.person_id, None)
+            self.template_data.pop(photo.person_id, None)
+        Path(photo.path).unlink(missing_ok=True)
+
+    def memory_report(self) -> Dict[str, int]:
+        """
+        Method reports memory used by the gallery. Only encodings are kept in memory, photos are read from disk
+        when a preview is requested
+
+        :return: number of photos, bytes used by the face index and resident set size of the process
+        """
+        return {
+            'photos': len(self.matcher),
+            'index_bytes': self.matcher.nbytes,
+            'rss_bytes': rss_bytes(),
+        }
+
+    def rename_person(self, person_id, full_name, role):
+        """
+        Method changes name and role of a person
+
+        :param person_id: id of the person
+        :param full_name: new full name
+        :param role: new role
+        """
+        new_person_id = self.gallery.rename_person(person_id, full_name, role)
+        if new_person_id != person_id:
+            self.face_names.pop(person_id, None)
+            self.template_data.pop(person_id, None)
+            self.matcher.merge(person_id, new_person_id)
+        self.__set_person(new_person_id, full_name, role)
+
+    def set_star_title(self, source: str = None):
+        if self.obs is not None:
+            self.obs.set_text(caption_inputs.get(source, "detected_name"), "Тут будет человек!")
 
     def connect_obs(self):
-        self.ws = obsws(host, port, password)
-        self.ws.connect()
+        """
+        Method (re)starts the OBS client with the current settings, the connection is kept alive in the background
+        """
+        if self.obs is not None:
+            self.obs.stop()
+        self.obs = ObsClient(config.host, config.port, config.password)
+        self.obs.start()
 
         self.set_star_title()
     
     def send_ndi(self):
-        with open('text.txt', 'r') as fin:
-            self.client.send(CG_ADD(video_channel=1,
-                                    cg_layer=1, template="TITLE",
-                                    play_on_load=0,
-                                    data=fin.readline().strip()))
+        """
+        Method takes the CasparCG title on air, its data is already sent when the person is recognized
+        """
+        self.caspar.play()
+
+    def stop_ndi(self):
+        self.caspar.stop()
 
-    def recognize(self, frame) -> None:
+    def identify_people(self, tracker: FaceTracker, people: List[Person], encodings) -> int:
         """
-        Method updates people with their names and roles using face recognition
-        
-        :param people: list of Person-class objects each representing a detected person
-        """
-        # encodings = face_recognition.face_encodings(frame)
-        # for enc in encodings:
-        #     matches = face_recognition.compare_faces(self.face_encodings, enc)
-        #     try:
-        #         index = matches.index(True)
-        #         if self.face_names[index][0] not in self.recognized_people:
-        #             text = f'<templateData><componentData id=\"Text1\"><data id=\"text\" value=\"{self.face_names[index][0]}\"/></componentData><componentData id=\"Text2\"><data id=\"text\" value=\"{self.face_names[index][1]}\"/></componentData></templateData>'
-        #             self.recognized_people.add(self.face_names[index][0])
-        #             nl = '\n'
-        #             self.ws.call(requests.SetInputSettings(inputName="detected_name",
-        #                                                    inputSettings={"text":f"{nl.join(self.face_names[index][0].split())}"}))
-        #             keyboard.unhook_all()
-        #             keyboard.add_hotkey('ctrl + shift + l', self.send_ndi, args=(text,))
-        #     except BaseException:
-        #         pass
-        encodings = face_recognition.face_encodings(frame)
-        if encodings:
-            enc = encodings[0]
-            matches = face_recognition.compare_faces(self.face_encodings, enc)
-            try:
-                index = matches.index(True)
-                self.text = f'<templateData><componentData id=\"Text1\"><data id=\"text\" value=\"{self.face_names[index][0]}\"/></componentData><componentData id=\"Text2\"><data id=\"text\" value=\"{self.face_names[index][1]}\"/></componentData></templateData>'
-                with open('text.txt', 'w') as fin:
-                    fin.write(self.text)
-                nl = '\n'
-                self.ws.call(requests.SetInputSettings(inputName="detected_name",
-                                                       inputSettings={"text": f"{nl.join(self.face_names[index][0].split())}"}))
-
-                # self.ws.call(requests.SetInputSettings(inputName="detected_image",
-                #                                        inputSettings={
-                #                                            "unload": True
-                #                                        }))
-                # print(self.ws.call(requests.GetInputSettings(inputName="detected_image")))
-                # keyboard.unhook_all()
-                # keyboard.add_hotkey('ctrl + shift + l', self.send_ndi)
-            except BaseException:
-                pass
+        Method matches encodings of tracked people against known faces and stores their identities in the tracker
+
+        :param tracker: FaceTracker the people belong to
+        :param people: people whose faces were encoded
+        :param encodings: encodings of their faces in the same order
+        :return: number of faces matched with known people
+        """
+        if not encodings:
+            return 0
+        matched = 0
+        for person, match in zip(people, self.matcher.match(encodings)):
+            if match.id is None:
+                tracker.set_identity(person, None)
+            else:
+                tracker.set_identity(person, match.id, *self.face_names[match.id])
+                matched += 1
+        return matched
+
+    def show(self, person_id, source: str = None) -> None:
+        """
+        Method puts name and role of a known person on the title
+
+        :param person_id: id of the person in the gallery
+        :param source: name of the camera the face was recognized on, each camera can have its own OBS input
+        """
+        if person_id not in self.face_names:
+            return
+        full_name, role = self.face_names[person_id]
+        self.text = self.template_data[person_id]
+        self.caspar.update(self.text)
+        if self.obs is not None:
+            self.obs.set_text(caption_inputs.get(source, "detected_name"), '\n'.join(full_name.split()))
 
             
 class BufferlessVideoCapture:
+    seq: int
+    dropped: int
+    timestamp: float
 
-    def __init__(self) -> None:
+    def __init__(self, lost_timeout: float = 10.0, name: str = '') -> None:
         """
-        Constructor to create a VideoCapture from OpenCV that doesn't use a buffer for frames
+        Constructor to create a VideoCapture from OpenCV that doesn't use a buffer for frames.
+        The reader thread decodes every frame into a single latest-frame slot, consumers wait for a newer frame
+
+        :param lost_timeout: time in seconds without frames after which the stream is considered lost
+        :param name: name of the camera in metrics
         """
+        self.lost_timeout = lost_timeout
+        self.name = name
         self.stop_event = threading.Event()
         self.stop_event.set()
         self.cap = cv2.VideoCapture()
         self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self.condition = threading.Condition()
+        self.reader_thread = None
+        self.frame = None
+        self.seq = 0
+        self.timestamp = 0.0
+        self.consumed_seq = 0
+        self.consumed_timestamp = 0.0
+        self.dropped = 0
     
     def is_opened(self):
-        return self.cap.isOpened()
+        return self.cap.isOpened() and not self.stop_event.is_set()
     
     def setup(self, uri):
         """
         :param uri: RTSP uri
         """
         self.cap.open(uri)
+        with self.condition:
+            self.frame = None
+            self.seq = self.consumed_seq = self.dropped = 0
         self.stop_event.clear()
-        reader_thread = threading.Thread(target=self.capture, daemon=True)
-        reader_thread.start()
+        self.reader_thread = threading.Thread(target=self.capture, daemon=True)
+        self.reader_thread.start()
     
     def capture(self) -> None:
         """
-        Private method that should be used as Thread's target. Method reads frames from capture and discards any buffer.
+        Private method that should be used as Thread's target. Method decodes frames from capture into the
+        latest-frame slot, a frame that wasn't read before the next one arrived is counted as dropped.
         """
+        last_frame_time = time.monotonic()
+        while not self.stop_event.is_set():
+            # grab mostly waits for the next frame of the stream, retrieve converts the decoded frame to BGR
+            start = time.perf_counter()
+            ok = self.cap.grab()
+            grabbed = time.perf_counter()
+            if ok:
+                ok, frame = self.cap.retrieve()
+            if not ok:
+                if not self.cap.isOpened() or time.monotonic() - last_frame_time > self.lost_timeout:
+                    break
+                self.stop_event.wait(0.01)
+                continue
+            last_frame_time = time.monotonic()
+            metrics.stage_seconds.observe(grabbed - start, self.name, 'grab')
+            metrics.stage_seconds.observe(time.perf_counter() - grabbed, self.name, 'retrieve')
+
+            with self.condition:
+                if self.frame is not None and self.seq > self.consumed_seq:
+                    self.dropped += 1
+                    metrics.frames_total.inc(self.name, 'dropped')
+                self.frame = frame
+                self.seq += 1
+                self.timestamp = time.monotonic()
+                self.condition.notify_all()
+
+        with self.condition:
+            self.stop_event.set()
+            self.condition.notify_all()
+
+    def read(self, timeout: float = 1.0):
+        """
+        Method waits until a frame newer than the previously read one is captured and returns it
 
-        while True:
-            self.cap.grab()
-            if self.stop_event.is_set():
-                break
-            
-
-    def read(self):
+        :param timeout: maximal waiting time in seconds
+        :return: OpenCV frame or None if there was no new frame in time or the capture is stopped
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.seq > self.consumed_seq or self.stop_event.is_set(),
+                                           timeout):
+                return None
+            if self.seq <= self.consumed_seq:
+                return None
+            self.consumed_seq = self.seq
+            self.consumed_timestamp = self.timestamp
+            return self.frame
+
+    async def read_async(self, timeout: float = 1.0):
         """
-        Method returns the current frame from the capture
+        Method waits for a new frame without blocking the event loop
 
-        :return: OpenCV frame
+        :param timeout: maximal waiting time in seconds
+        :return: OpenCV frame or None
         """
+        return await asyncio.get_running_loop().run_in_executor(None, self.read, timeout)
 
-        _, frame = self.cap.retrieve()
-        return frame
+    def frame_age(self) -> float:
+        """
+        Method returns time in seconds since the last read frame was captured
+        """
+        return time.monotonic() - self.consumed_timestamp
 
     def release(self) -> None:
         """
-        Method releases OpenCV capture, resets the reading Thread and sets stop_event
+        Method releases OpenCV capture, stops the reading Thread and sets stop_event
         """
-        self.stop_event.set()
-        time.sleep(0.5)
+        with self.condition:
+            self.stop_event.set()
+            self.condition.notify_all()
+        if self.reader_thread is not None:
+            self.reader_thread.join(timeout=2)
+            self.reader_thread = None
         self.cap.release()
 
+class Camera:
+    name: str
+    uri: Union[str, int]
+
+    def __init__(self, name: str, uri: Union[str, int]) -> None:
+        """
+        Constructor creates per-camera state: capture, scene change gate and face tracker
+
+        :param name: name the recognition results of the camera are tagged with
+        :param uri: RTSP uri or index of a local camera
+        """
+        self.name = name
+        self.uri = uri
+        self.vid = BufferlessVideoCapture(name=name)
+        self.gate = SceneChangeGate(scene_change_threshold, scene_max_interval)
+        self.tracker = FaceTracker()
+        self.captions = CaptionController(caption_switch_frames, caption_min_hold, caption_clear_after)
+        self.last_processed = 0.0
+        self.rejected = dict.fromkeys(REASONS, 0)
+        self.rois = camera_rois.get(name) or [(0.0, 0.0, 1.0, 1.0)]
+        self.region_shape = None
+        self.region_list = []
+
+    def regions(self, shape: Tuple[int, ...]) -> List[Tuple[int, int, int, int]]:
+        """
+        Method converts the ROIs of the camera to pixels of frames of the given shape
+
+        :param shape: shape of the frame
+        :return: list of regions as (top, bottom, left, right)
+        """
+        if self.region_shape != shape[:2]:
+            height, width = shape[:2]
+            self.region_list = [(int(top * height), int(min(1.0, top + roi_height) * height),
+                                 int(left * width), int(min(1.0, left + roi_width) * width))
+                                for left, top, roi_width, roi_height in self.rois]
+            self.region_shape = shape[:2]
+        return self.region_list
+
+
 class Main:
+    cameras: List[Camera]
+
     def __init__(self):
         self.rec = Recognizer()
-        self.vid = BufferlessVideoCapture()
-        
+        self.cameras = []
+        self.workers = []
+        self.free_workers = None
+        # the scheduler lives as long as the bot, so its settings and decisions can be inspected between shows
+        self.scheduler = AdaptiveScheduler(quality_levels(camera_fps_budget, detection_scale, detection_upsample,
+                                                          adaptive_min_fps, adaptive_min_scale),
+                                           adaptive_latency, adaptive_cpu_budget, 1, adaptive_interval,
+                                           enabled=adaptive_scheduler)
+
     async def start(self, uri):
         '''
-        uri: rtsp поток
+        uri: rtsp поток или список потоков, все камеры распознаются по общей базе людей
         '''
-        self.vid.setup(uri)
-        while self.vid.is_opened():
-            frame = self.vid.read()
-            if frame is not None:
-                image = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                #image = cv2.resize(frame, (640, 480))
-                self.rec.recognize(image)
-            await asyncio.sleep(0.01)
-        await self.end()
-    
+        uris = uri if isinstance(uri, (list, tuple)) else [uri]
+        self.cameras = [Camera(f'cam{idx + 1}', camera_uri) for idx, camera_uri in enumerate(uris)]
+
+        # one worker process per camera, but not more than there are spare cores
+        workers_count = min(len(self.cameras), max(1, (os.cpu_count() or 2) - 1)) if recognition_worker else 1
+        self.workers = [RecognitionWorker() if recognition_worker else InlineWorker() for _ in range(workers_count)]
+        self.free_workers = asyncio.Queue()
+        for worker in self.workers:
+            worker.start()
+            self.free_workers.put_nowait(worker)
+        self.scheduler.restart(len(self.workers))
+
+        try:
+            for camera in self.cameras:
+                camera.vid.setup(camera.uri)
+            await asyncio.gather(*(self.__run_camera(camera) for camera in self.cameras))
+        finally:
+            # a failed camera must not leave worker processes, shared memory and other captures running
+            await self.end()
+
+    async def __run_camera(self, camera: Camera) -> None:
+        """
+        Method recognizes faces on frames of one camera. Cameras take turns on free workers in the order they asked
+        for them, and each camera processes at most as many frames per second as the scheduler allows
+
+        :param camera: Camera object
+        """
+        while camera.vid.is_opened():
+            frame = await camera.vid.read_async()
+            if frame is None:
+                continue
+            now = time.monotonic()
+            if now - camera.last_processed < 1 / self.scheduler.settings.fps:
+                metrics.frames_total.inc(camera.name, 'skipped_budget')
+                continue
+            if not camera.gate.should_process(frame, now):
+                metrics.frames_total.inc(camera.name, 'skipped_unchanged')
+                continue
+            camera.last_processed = now
+
+            worker = await self.free_workers.get()
+            start = time.perf_counter()
+            try:
+                await self.__process(camera, worker, frame)
+            except WorkerStopped as e:
+                if e.args:
+                    print(f'{camera.name}: {e}')
+                break
+            finally:
+                self.free_workers.put_nowait(worker)
+            # the capture timestamp of the frame is kept until the next read, so its age is the caption latency
+            self.scheduler.observe(camera.vid.frame_age(), time.perf_counter() - start)
+
+    async def __process(self, camera: Camera, worker, frame: np.ndarray) -> None:
+        stage_seconds = metrics.stage_seconds
+        stage_seconds.observe(camera.vid.frame_age(), camera.name, 'capture_age')
+        metrics.frames_total.inc(camera.name, 'processed')
+
+        settings = self.scheduler.settings
+        locations = []
+        with stage_seconds.time(camera.name, 'detect'):
+            for top, bottom, left, right in camera.regions(frame.shape):
+                # HOG takes the strongest gradient over colour channels, so the detector runs on the BGR region as is
+                region = worker.buffer((bottom - top, right - left) + frame.shape[2:])
+                np.copyto(region, frame[top:bottom, left:right])
+                for face_top, face_right, face_bottom, face_left in await worker.call('locate_faces',
+                                                                                      settings.upsample,
+                                                                                      settings.scale):
+                    locations.append((face_top + top, face_right + left, face_bottom + top, face_left + left))
+        people = camera.tracker.update(frame, locations)
+        pending = camera.tracker.needs_identification(people)
+        if pending:
+            faces = [person.face_bounding_box.location() for person in pending]
+            height, width = frame.shape[:2]
+            top, bottom = max(0, min(face[0] for face in faces)), min(height, max(face[2] for face in faces))
+            left, right = max(0, min(face[3] for face in faces)), min(width, max(face[1] for face in faces))
+            with stage_seconds.time(camera.name, 'cvtcolor'):
+                # only the part of the frame with faces to encode is converted to RGB
+                crop = worker.buffer((bottom - top, right - left, 3))
+                cv2.cvtColor(frame[top:bottom, left:right], cv2.COLOR_BGR2RGB, dst=crop)
+            with stage_seconds.time(camera.name, 'encode'):
+                encodings, reasons = await worker.call('encode_good_faces',
+                                                       [(face_top - top, face_right - left, face_bottom - top,
+                                                         face_left - left)
+                                                        for face_top, face_right, face_bottom, face_left in faces],
+                                                       face_quality)
+            for reason in reasons:
+                if reason is not None:
+                    camera.rejected[reason] += 1
+                    metrics.faces_total.inc(camera.name, f'rejected_{reason}')
+            # rejected people keep low identity confidence and are checked again on the next frame
+            good = [(person, enc) for person, enc in zip(pending, encodings) if enc is not None]
+            with stage_seconds.time(camera.name, 'match'):
+                matched = self.rec.identify_people(camera.tracker, [person for person, _ in good],
+                                                   [enc for _, enc in good])
+            metrics.faces_total.inc(camera.name, 'matched', amount=matched)
+            metrics.faces_total.inc(camera.name, 'unknown', amount=len(good) - matched)
+        on_air = select_on_air([(person.face_id, person.face_bounding_box.location())
+                                for person in people if person.face_id is not None], frame.shape, caption_policy)
+        if camera.captions.update(on_air):
+            with stage_seconds.time(camera.name, 'publish'):
+                if camera.captions.on_air is None:
+                    self.rec.set_star_title(camera.name)
+                else:
+                    self.rec.show(camera.captions.on_air, camera.name)
+
     async def end(self):
-        self.vid.release()            
+        # end is called both by the bot command and when start finishes, only the first call stops recognition
+        if not self.workers:
+            return
+        for camera in self.cameras:
+            camera.vid.release()
+            camera.tracker.reset()
+        for worker in self.workers:
+            worker.stop()
+        self.workers = []
+        for camera in self.cameras:
+            print(f'{camera.name}: frames processed: {camera.gate.processed}, '
+                  f'skipped as unchanged: {camera.gate.skipped}, dropped by capture: {camera.vid.dropped}, '
+                  f'faces rejected by quality: {camera.rejected}')
 
 # class Stream():
 #     """Class for managing stream from camera"""
@@ -0,0 +1,170 @@
+import time
+from collections import deque
+from typing import List, NamedTuple, Optional
+
+import metrics
+
+
+class Settings(NamedTuple):
+    fps: float
+    scale: float
+    upsample: int
+
+
+def quality_levels(fps: float, scale: float, upsample: int, min_fps: float, min_scale: float) -> List[Settings]:
+    """
+    Function builds the ladder of recognition settings from the best to the cheapest one. Detector upsampling is
+    dropped first since every level of it quadruples the detection cost, then frames are downscaled further and
+    only then the frame rate is lowered, as it delays captions the most
+
+    :param fps: recognized frames per second of each camera at the best level
+    :param scale: detection downscale factor at the best level
+    :param upsample: detector upsampling at the best level
+    :param min_fps: lowest frame rate
+    :param min_scale: lowest detection downscale factor
+    :return: list of settings
+    """
+    levels = [Settings(fps, scale, upsample)]
+    while upsample > 0:
+        upsample -= 1
+        levels.append(Settings(fps, scale, upsample))
+    while scale > min_scale:
+        scale = max(min_scale, round(scale * 0.75, 3))
+        levels.append(Settings(fps, scale, upsample))
+    while fps > min_fps:
+        fps = max(min_fps, round(fps / 1.5, 1))
+        levels.append(Settings(fps, scale, upsample))
+    return levels
+
+
+class AdaptiveScheduler:
+    levels: List[Settings]
+    level: int
+    target_latency: float
+    cpu_budget: float
+
+    def __init__(self, levels: List[Settings], target_latency: float = 0.3, cpu_budget: float = 0.8,
+                 workers: int = 1, interval: float = 2.0, headroom: float = 0.6, restore_after: int = 3,
+                 enabled: bool = True) -> None:
+        """
+        Constructor creates a controller that keeps recognition within a latency and CPU budget. Every interval it
+        looks at the processed frames: if captions are late or workers are busier than the budget, it steps one level
+        down at once, and it steps one level up only after restore_after intervals in a row with headroom, so the
+        settings don't oscillate
+
+        :param levels: settings from the best to the cheapest, see quality_levels
+        :param target_latency: time in seconds from capturing a frame to the caption decision on it
+        :param cpu_budget: fraction of the time of all recognition workers they may be busy
+        :param workers: number of recognition workers
+        :param interval: time in seconds between decisions
+        :param headroom: fraction of both budgets under which the quality is restored
+        :param restore_after: number of intervals in a row with headroom before stepping one level up
+        :param enabled: False keeps the best level
+        """
+        self.levels = levels
+        self.level = 0
+        self.target_latency = target_latency
+        self.cpu_budget = cpu_budget
+        self.workers = workers
+        self.interval = interval
+        self.headroom = headroom
+        self.restore_after = restore_after
+        self.enabled = enabled
+
+        self.window_start = None
+        self.frames = 0
+        self.latency_sum = 0.0
+        self.busy = 0.0
+        self.good_windows = 0
+        self.latency = 0.0
+        self.utilization = 0.0
+        self.decisions = deque(maxlen=50)
+        self.__publish()
+
+    def restart(self, workers: int) -> None:
+        """
+        Method starts measuring anew when recognition is started, the current level is kept
+
+        :param workers: number of recognition workers
+        """
+        self.workers = workers
+        self.window_start = None
+        self.frames = 0
+        self.latency_sum = 0.0
+        self.busy = 0.0
+        self.good_windows = 0
+
+    @property
+    def settings(self) -> Settings:
+        return self.levels[self.level]
+
+    def observe(self, latency: float, busy: float, now: Optional[float] = None) -> bool:
+        """
+        Method records a processed frame and makes a decision when the interval is over
+
+        :param latency: time in seconds from capturing the frame to the caption decision on it
+        :param busy: time in seconds a worker was held for the frame
+        :param now: current time, time.monotonic() by default
+        :return: True if the settings were changed
+        """
+        now = time.monotonic() if now is None else now
+        if self.window_start is None:
+            self.window_start = now
+            return False
+        self.frames += 1
+        self.latency_sum += latency
+        self.busy += busy
+        elapsed = now - self.window_start
+        if elapsed < self.interval:
+            return False
+
+        self.latency = self.latency_sum / self.frames
+        self.utilization = self.busy / (elapsed * self.workers)
+        self.window_start = now
+        self.frames = 0
+        self.latency_sum = 0.0
+        self.busy = 0.0
+        if not self.enabled:
+            return False
+
+        if self.latency > self.target_latency or self.utilization > self.cpu_budget:
+            self.good_windows = 0
+            if self.level + 1 < len(self.levels):
+                reason = 'latency' if self.latency > self.target_latency else 'cpu'
+                return self.__change(self.level + 1, reason)
+            return False
+
+        if self.latency < self.target_latency * self.headroom and self.utilization < self.cpu_budget * self.headroom:
+            self.good_windows += 1
+            if self.good_windows >= self.restore_after and self.level > 0:
+                self.good_windows = 0
+                return self.__change(self.level - 1, 'headroom')
+        else:
+            self.good_windows = 0
+        return False
+
+    def __change(self, level: int, reason: str) -> bool:
+        previous = self.settings
+        self.level = level
+        self.decisions.append({'time': time.time(), 'reason': reason, 'level': level,
+                               'latency': round(self.latency, 4), 'utilization': round(self.utilization, 3),
+                               'from': previous._asdict(), 'to': self.settings._asdict()})
+        print(f'Scheduler: {reason}, latency {self.latency * 1000:.0f} ms, workers busy {self.utilization:.0%}, '
+              f'level {level}: {self.settings.fps} fps, scale {self.settings.scale}, upsample {self.settings.upsample}')
+        metrics.scheduler_changes_total.inc(reason)
+        self.__publish()
+        return True
+
+    def __publish(self) -> None:
+        metrics.scheduler_setting.set(self.level, 'level')
+        for name, value in self.settings._asdict().items():
+            metrics.scheduler_setting.set(value, name)
+
+    def state(self) -> dict:
+        """
+        Method returns the current settings, measurements of the last interval and recent decisions
+        """
+        return {'enabled': self.enabled, 'level': self.level, 'levels': len(self.levels),
+                'settings': self.settings._asdict(), 'target_latency': self.target_latency,
+                'cpu_budget': self.cpu_budget, 'workers': self.workers, 'latency': self.latency,
+                'utilization': self.utilization, 'decisions': list(self.decisions)}
@@ -0,0 +1,179 @@
+import asyncio
+import multiprocessing as mp
+import queue
+from multiprocessing import shared_memory
+from typing import Optional, Tuple
+
+import numpy as np
+
+import detection
+
+
+class WorkerStopped(Exception):
+    pass
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        # the block is owned by the parent process, the worker must not unlink it on exit
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(block._name, 'shared_memory')
+    except Exception:
+        pass
+    return block
+
+
+def _worker_loop(requests: mp.Queue, results: mp.Queue) -> None:
+    """
+    Target of the worker process: runs functions from the detection module on frames placed into shared memory
+    """
+    block = None
+    while True:
+        request = requests.get()
+        if request is None:
+            break
+
+        seq, name, block_name, shape, dtype, args = request
+        frame = None
+        try:
+            if block is None or block.name != block_name:
+                if block is not None:
+                    block.close()
+                block = _attach(block_name)
+            frame = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+            results.put((seq, getattr(detection, name)(frame, *args), None))
+        except Exception as e:
+            results.put((seq, None, e))
+        finally:
+            del frame
+
+    if block is not None:
+        block.close()
+
+
+class RecognitionWorker:
+    process: Optional[mp.Process]
+    block: Optional[shared_memory.SharedMemory]
+
+    def __init__(self) -> None:
+        """
+        Constructor creates a worker that runs face detection and encoding in a separate process, so the asyncio
+        event loop stays responsive. Frames are passed through shared memory without pickling
+        """
+        self.process = None
+        self.block = None
+        self.frame = None
+        self.seq = 0
+        self.requests = None
+        self.results = None
+
+    def start(self) -> None:
+        if self.process is not None and self.process.is_alive():
+            return
+        self.requests = mp.Queue()
+        self.results = mp.Queue()
+        self.process = mp.Process(target=_worker_loop, args=(self.requests, self.results), daemon=True)
+        self.process.start()
+
+    def buffer(self, shape: Tuple[int, ...], dtype=np.uint8) -> np.ndarray:
+        """
+        Method returns an array in shared memory that the next image should be written to. Shared memory is
+        reallocated only when the image doesn't fit, so regions and crops of different sizes reuse the same block.
+        The array must not be modified while a call is in progress
+
+        :param shape: shape of the image
+        :param dtype: dtype of the image
+        :return: array backed by shared memory
+        """
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if self.block is None or self.block.size < nbytes:
+            self.__free()
+            self.block = shared_memory.SharedMemory(create=True, size=nbytes)
+        if self.frame is None or self.frame.shape != tuple(shape) or self.frame.dtype != dtype:
+            self.frame = np.ndarray(shape, dtype=dtype, buffer=self.block.buf)
+        return self.frame
+
+    async def call(self, name: str, *args):
+        """
+        Method runs a function of the detection module on the current buffer in the worker process and waits for
+        its result without blocking the event loop
+
+        :param name: name of the function from the detection module
+        :param args: extra arguments of the function
+        :return: result of the function
+        """
+        self.seq += 1
+        self.requests.put((self.seq, name, self.block.name, self.frame.shape, self.frame.dtype.str, args))
+
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                seq, result, error = await loop.run_in_executor(None, self.results.get, True, 1.0)
+            except queue.Empty:
+                # the process may have died without answering, e.g. if it failed on import
+                if self.process is None or not self.process.is_alive():
+                    exitcode = self.process.exitcode if self.process is not None else None
+                    raise WorkerStopped(f'Recognition worker exited with code {exitcode}')
+                continue
+            if seq is None:
+                raise WorkerStopped()
+            if seq == self.seq:
+                break
+        if error is not None:
+            raise error
+        return result
+
+    def __free(self) -> None:
+        self.frame = None
+        if self.block is not None:
+            try:
+                self.block.close()
+            except BufferError:
+                # a caller still holds a view of the old frame, the mapping is released together with it
+                pass
+            self.block.unlink()
+            self.block = None
+
+    def stop(self) -> None:
+        """
+        Method stops the worker process and frees shared memory
+        """
+        if self.process is not None:
+            self.requests.put(None)
+            self.process.join(timeout=5)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.process = None
+            # wake up a call that is still waiting for a result
+            self.results.put((None, None, None))
+        self.__free()
+
+
+class InlineWorker:
+
+    def __init__(self) -> None:
+        """
+        Constructor creates a worker with the same interface as RecognitionWorker that runs detection in the calling
+        thread
+        """
+        self.block = None
+        self.frame = None
+
+    def start(self) -> None:
+        pass
+
+    def buffer(self, shape: Tuple[int, ...], dtype=np.uint8) -> np.ndarray:
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        if self.block is None or len(self.block) < nbytes:
+            self.block = np.empty(nbytes, dtype=np.uint8)
+        if self.frame is None or self.frame.shape != tuple(shape) or self.frame.dtype != dtype:
+            self.frame = self.block[:nbytes].view(dtype).reshape(shape)
+        return self.frame
+
+    async def call(self, name: str, *args):
+        return getattr(detection, name)(self.frame, *args)
+
+    def stop(self) -> None:
+        self.block = None
+        self.frame = None